@@ -0,0 +1,114 @@
+"""Stand-in for the adb executable, serving devices from local folders.
+
+Every folder under $FAKE_ADB_ROOT is a device named after its serial, and its
+contents are the device filesystem (e.g. $FAKE_ADB_ROOT/BENCH01/sdcard/DCIM/...).
+`adb shell` commands run through the host's /bin/sh with device paths rewritten,
+so find/stat/ls/rm behave like the toybox versions on a phone.
+
+Optional environment:
+    FAKE_TOOL_LOG        append one line per invocation, for subprocess counting
+    FAKE_ADB_LATENCY     seconds added to every invocation (USB round trip)
+    FAKE_ADB_BANDWIDTH   bytes/sec cap applied to `adb pull`
+"""
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+DEVICE_PATH_PREFIXES = ("/sdcard", "/storage")
+
+
+def log_invocation(args):
+    log_path = os.environ.get("FAKE_TOOL_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write("adb " + (args[0] if args else "") + "\n")
+
+
+def list_serials(root):
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def to_host(device_root, text):
+    for prefix in DEVICE_PATH_PREFIXES:
+        text = text.replace(prefix, device_root + prefix)
+    return text
+
+
+def track_devices(serials):
+    payload = "".join(f"{serial}\tdevice\n" for serial in serials)
+    sys.stdout.write(f"{len(payload.encode('utf-8')):04x}{payload}")
+    sys.stdout.flush()
+    while True:
+        time.sleep(3600)
+
+
+def main(argv):
+    root = os.environ["FAKE_ADB_ROOT"]
+    serial = None
+    if argv[:1] == ["-s"]:
+        serial, argv = argv[1], argv[2:]
+
+    log_invocation(argv)
+    latency = float(os.environ.get("FAKE_ADB_LATENCY", "0"))
+    if latency:
+        time.sleep(latency)
+
+    serials = list_serials(root)
+    command = argv[0] if argv else ""
+
+    if command == "devices":
+        print("List of devices attached")
+        for name in serials:
+            print(f"{name}\tdevice")
+        return 0
+    if command == "track-devices":
+        track_devices(serials)
+        return 0
+
+    if serial is None:
+        if len(serials) != 1:
+            sys.stderr.write("adb: more than one device/emulator\n" if serials else "adb: no devices/emulators found\n")
+            return 1
+        serial = serials[0]
+    if serial not in serials:
+        sys.stderr.write(f"adb: device '{serial}' not found\n")
+        return 1
+    device_root = os.path.join(root, serial)
+
+    if command == "get-serialno":
+        print(serial)
+        return 0
+
+    if command == "shell":
+        # Real adb joins the arguments with spaces and hands them to the device shell
+        script = to_host(device_root, " ".join(argv[1:]))
+        result = subprocess.run(["/bin/sh", "-c", script], capture_output=True)
+        sys.stdout.buffer.write(result.stdout.replace(device_root.encode(), b""))
+        sys.stderr.buffer.write(result.stderr.replace(device_root.encode(), b""))
+        return result.returncode
+
+    if command == "pull" and len(argv) == 3:
+        src = to_host(device_root, argv[1])
+        dest = argv[2]
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        try:
+            # copyfile, not copy2: like adb pull without -a, the local mtime is the pull time
+            shutil.copyfile(src, dest)
+        except OSError as e:
+            sys.stderr.write(f"adb: error: failed to copy '{argv[1]}': {e.strerror}\n")
+            return 1
+        bandwidth = float(os.environ.get("FAKE_ADB_BANDWIDTH", "0"))
+        if bandwidth:
+            time.sleep(os.path.getsize(dest) / bandwidth)
+        print(f"{argv[1]}: 1 file pulled")
+        return 0
+
+    sys.stderr.write(f"adb: unsupported command: {' '.join(argv)}\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,39 @@
+"""Stand-in for exiftool: records the call and rewrites the file in place like -overwrite_original.
+
+Set FAKE_EXIFTOOL_LATENCY to model exiftool's Perl start-up cost (typically 0.1-0.3 s).
+"""
+import os
+import sys
+import time
+
+
+def main(argv):
+    log_path = os.environ.get("FAKE_TOOL_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write("exiftool\n")
+
+    latency = float(os.environ.get("FAKE_EXIFTOOL_LATENCY", "0"))
+    if latency:
+        time.sleep(latency)
+
+    files = [arg for arg in argv if not arg.startswith("-")]
+    for path in files:
+        if not os.path.isfile(path):
+            sys.stderr.write(f"Error: File not found - {path}\n")
+            return 1
+        # exiftool writes a temporary copy and renames it over the original
+        tmp_path = path + "_exiftool_tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as dest:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dest.write(chunk)
+        os.replace(tmp_path, path)
+    print(f"    {len(files)} image files updated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
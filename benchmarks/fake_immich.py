@@ -0,0 +1,217 @@
+"""Local HTTP stand-in for the Immich endpoints this tool calls, with configurable latency."""
+import json
+import time
+import uuid
+import base64
+import hashlib
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeImmichState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = {}
+        self.checksums = {}
+        self.albums = {}
+        self.requests = {}
+
+    def count(self, key):
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+def extract_file_part(body, content_type):
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    fields = {}
+    file_data = b""
+    filename = ""
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        headers, _, data = part.partition(b"\r\n\r\n")
+        data = data[:-2] if data.endswith(b"\r\n") else data
+        headers = headers.decode("utf-8", errors="replace")
+        name = headers.split('name="', 1)[1].split('"', 1)[0] if 'name="' in headers else ""
+        if 'filename="' in headers:
+            file_data = data
+            filename = headers.split('filename="', 1)[1].split('"', 1)[0]
+        else:
+            fields[name] = data.decode("utf-8", errors="replace")
+    return fields, filename, file_data
+
+
+def make_handler(state, latency):
+    class FakeImmichHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per request
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def handle_request(self, method):
+            body = self.read_body()
+            if latency:
+                time.sleep(latency)
+            path = self.path.split("?", 1)[0]
+            route = "/api/albums/{id}/assets" if path.startswith("/api/albums/") else path
+            state.count(f"{method} {route}")
+            if self.headers.get("x-api-key") is None:
+                return self.send_json(401, {"message": "Authentication required"})
+
+            if method == "GET" and path == "/api/server/ping":
+                return self.send_json(200, {"res": "pong"})
+
+            if method == "POST" and path == "/api/assets":
+                fields, filename, data = extract_file_part(body, self.headers.get("Content-Type", ""))
+                checksum = hashlib.sha1(data).hexdigest()
+                with state.lock:
+                    if checksum in state.checksums:
+                        return self.send_json(200, {"id": state.checksums[checksum], "status": "duplicate"})
+                    asset_id = str(uuid.uuid4())
+                    state.checksums[checksum] = asset_id
+                    state.assets[asset_id] = {
+                        "id": asset_id,
+                        "checksum": checksum,
+                        "deviceAssetId": fields.get("deviceAssetId", ""),
+                        "deviceId": fields.get("deviceId", ""),
+                        "originalFileName": filename,
+                        "fileSize": len(data),
+                        "updatedAt": time.time(),
+                    }
+                return self.send_json(201, {"id": asset_id, "status": "created"})
+
+            if method == "POST" and path == "/api/assets/bulk-upload-check":
+                results = []
+                for item in json.loads(body or b"{}").get("assets", []):
+                    checksum = item.get("checksum", "")
+                    if len(checksum) != 40:
+                        checksum = base64.b64decode(checksum).hex()
+                    with state.lock:
+                        asset_id = state.checksums.get(checksum)
+                    if asset_id:
+                        results.append({"id": item["id"], "action": "reject", "reason": "duplicate",
+                                        "assetId": asset_id, "isTrashed": False})
+                    else:
+                        results.append({"id": item["id"], "action": "accept"})
+                return self.send_json(200, {"results": results})
+
+            if method == "POST" and path == "/api/search/metadata":
+                query = json.loads(body or b"{}")
+                page, size = int(query.get("page", 1)), int(query.get("size", 250))
+                updated_after = query.get("updatedAfter")
+                with state.lock:
+                    assets = list(state.assets.values())
+                if updated_after:
+                    since = datetime.fromisoformat(updated_after).timestamp()
+                    assets = [asset for asset in assets if asset["updatedAt"] > since]
+                items = [{
+                    "id": asset["id"],
+                    "checksum": base64.b64encode(bytes.fromhex(asset["checksum"])).decode(),
+                    "deviceAssetId": asset["deviceAssetId"],
+                    "deviceId": asset["deviceId"],
+                    "originalFileName": asset["originalFileName"],
+                    "isTrashed": False,
+                    "exifInfo": {"fileSizeInByte": asset["fileSize"]} if query.get("withExif") else None,
+                } for asset in assets[(page - 1) * size:page * size]]
+                next_page = str(page + 1) if page * size < len(assets) else None
+                return self.send_json(200, {
+                    "albums": {"total": 0, "count": 0, "items": [], "facets": [], "nextPage": None},
+                    "assets": {"total": len(items), "count": len(items), "items": items, "facets": [],
+                               "nextPage": next_page},
+                })
+
+            if method == "GET" and path == "/api/albums":
+                with state.lock:
+                    albums = [{"id": album_id, "albumName": album["albumName"]}
+                              for album_id, album in state.albums.items()]
+                return self.send_json(200, albums)
+
+            if method == "POST" and path == "/api/albums":
+                name = json.loads(body or b"{}").get("albumName", "")
+                album_id = str(uuid.uuid4())
+                with state.lock:
+                    state.albums[album_id] = {"albumName": name, "assets": set()}
+                return self.send_json(201, {"id": album_id, "albumName": name})
+
+            if method == "PUT" and path.startswith("/api/albums/") and path.endswith("/assets"):
+                album_id = path.split("/")[3]
+                ids = json.loads(body or b"{}").get("ids", [])
+                with state.lock:
+                    album = state.albums.get(album_id)
+                    if album is None:
+                        return self.send_json(400, {"message": "Not found or no album.read access"})
+                    results = [{"id": asset_id, "success": asset_id not in album["assets"]} for asset_id in ids]
+                    album["assets"].update(ids)
+                return self.send_json(200, results)
+
+            return self.send_json(404, {"message": f"Cannot {method} {path}"})
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_PUT(self):
+            self.handle_request("PUT")
+
+    return FakeImmichHandler
+
+
+class FakeImmichServer:
+    """Runs the stand-in on a background thread; use as a context manager"""
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.state = FakeImmichState()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.state, latency))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a fake Immich API for local testing.")
+    parser.add_argument("--port", type=int, default=2283)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    args = parser.parse_args()
+    server = FakeImmichServer(latency=args.latency, port=args.port)
+    print(f"Fake Immich listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
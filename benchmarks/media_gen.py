@@ -0,0 +1,102 @@
+"""Builds synthetic phone media trees for the fake adb device."""
+import os
+import random
+
+# Smallest baseline JPEG that decoders (and piexif) accept: a 1x1 grey pixel
+TINY_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f141d1a1f"
+    "1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100ffc4001f0000"
+    "010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504040000017d010203000411"
+    "05122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a434445"
+    "464748494a535455565758595a636465666768696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9"
+    "aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100"
+    "003f00fbd3ffd9"
+)
+
+ODD_NAMES = [
+    "IMG 2024 beach day.jpg",
+    "foto_de_la_señora_ñandú_2023.jpg",
+    "it's_my_party_2022.jpg",
+    "what?a=1&b=2 2021.jpg",
+    "-leading-dash-2020.jpg",
+    "quote\"in\"name 2019.jpg",
+    "日本語の写真_2018.jpg",
+    "Screenshot.png",
+    "$dollar`tick`2017.gif",
+    "emoji_🎉_2016.webp",
+]
+
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def jpeg_bytes(size, rng):
+    """A valid JPEG padded to roughly size bytes with random COM segments"""
+    # Comments go after the JFIF APP0 segment, which must directly follow SOI
+    app0_end = 4 + int.from_bytes(TINY_JPEG[4:6], "big")
+    body = bytearray(TINY_JPEG[:app0_end])
+    remaining = max(size - len(TINY_JPEG), 0)
+    while remaining > 0:
+        chunk = min(remaining, 65000)
+        body += b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + random_bytes(rng, chunk)
+        remaining -= chunk + 4
+    body += TINY_JPEG[app0_end:]
+    return bytes(body)
+
+
+def write_random_file(path, size, rng, block=1024 * 1024):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, block)
+            f.write(random_bytes(rng, chunk))
+            remaining -= chunk
+
+
+def generate_device(device_root, small_files=500, small_size=200 * 1024, large_files=2,
+                    large_size=64 * 1024 * 1024, odd_names=True, seed=0):
+    """Populate device_root/sdcard with camera photos, screenshots, a few huge videos and odd names.
+
+    Returns the phone folders that contain media and the total number of media files and bytes.
+    """
+    rng = random.Random(seed)
+    folders = {
+        "camera": "/sdcard/DCIM/Camera",
+        "screenshots": "/sdcard/Pictures/Screenshots",
+        "whatsapp": "/sdcard/WhatsApp/Media/WhatsApp Images",
+        "odd": "/sdcard/Download/Odd & Ends",
+    }
+    for folder in folders.values():
+        os.makedirs(device_root + folder, exist_ok=True)
+
+    total_files = 0
+    total_bytes = 0
+    for i in range(small_files):
+        folder = folders["camera"] if i % 3 else rng.choice([folders["screenshots"], folders["whatsapp"]])
+        size = max(int(rng.gauss(small_size, small_size / 4)), 1024)
+        data = jpeg_bytes(size, rng)
+        with open(os.path.join(device_root + folder, f"IMG_{20240101 + i // 100}_{i:06d}.jpg"), "wb") as f:
+            f.write(data)
+        total_files += 1
+        total_bytes += len(data)
+
+    for i in range(large_files):
+        write_random_file(os.path.join(device_root + folders["camera"], f"VID_20240101_{i:06d}.mp4"), large_size, rng)
+        total_files += 1
+        total_bytes += large_size
+
+    if odd_names:
+        for name in ODD_NAMES:
+            data = jpeg_bytes(32 * 1024, rng) if name.endswith(".jpg") else random_bytes(rng, 32 * 1024)
+            with open(os.path.join(device_root + folders["odd"], name), "wb") as f:
+                f.write(data)
+            total_files += 1
+            total_bytes += len(data)
+
+    # Hidden files must be ignored by the scan
+    os.makedirs(device_root + "/sdcard/DCIM/.thumbnails", exist_ok=True)
+    with open(device_root + "/sdcard/DCIM/.thumbnails/thumb_0001.jpg", "wb") as f:
+        f.write(jpeg_bytes(4096, rng))
+
+    return ["/sdcard/DCIM", "/sdcard/Pictures", "/sdcard/WhatsApp/Media", "/sdcard/Download"], total_files, total_bytes
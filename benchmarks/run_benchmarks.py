@@ -0,0 +1,299 @@
+"""End-to-end throughput benchmark: fake phone -> pull -> upload -> compress -> delete.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --small-files 2000 --output bench_results.json
+    python -m benchmarks.run_benchmarks --baseline bench_results.json
+
+Needs a POSIX shell for the fake adb's `shell` command; the real requirements
+(requests, piexif) must be installed.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERIAL = "BENCH0001"
+
+
+def write_wrapper(directory, name, script):
+    """Make an executable that runs one of the fake tools with this interpreter"""
+    if os.name == "nt":
+        path = os.path.join(directory, name + ".cmd")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def reset_peak_rss():
+    """Restart this process's RSS high-water mark (Linux); False where that isn't possible"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(stage_reset=False):
+    """Peak RSS in MB. "self" covers just the stage when reset_peak_rss() worked before it, otherwise the
+    whole process so far ("self_scope" says which). Child processes can't be reset, so "children_cumulative"
+    is the largest adb/exiftool child of the run so far.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS; clear_refs resets it along with VmHWM
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "self": round(own / scale, 1),
+        "self_scope": "stage" if stage_reset else "process",
+        "children_cumulative": round(children / scale, 1),
+    }
+
+
+def read_tool_log(path):
+    if not os.path.exists(path):
+        return Counter()
+    with open(path, encoding="utf-8") as f:
+        return Counter(line.strip() for line in f if line.strip())
+
+
+class StageTimer:
+    def __init__(self, tool_log):
+        self.tool_log = tool_log
+        self.results = {}
+
+    def run(self, stage, func, files, nbytes=None):
+        before = read_tool_log(self.tool_log)
+        stage_reset = reset_peak_rss()
+        started = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - started
+        launched = read_tool_log(self.tool_log) - before
+
+        files = files(value) if callable(files) else files
+        nbytes = nbytes(value) if callable(nbytes) else nbytes
+        self.results[stage] = {
+            "seconds": round(seconds, 3),
+            "files": files,
+            "bytes": nbytes,
+            "files_per_sec": round(files / seconds, 2) if seconds else None,
+            "mb_per_sec": round(nbytes / seconds / 1e6, 2) if nbytes is not None and seconds else None,
+            "subprocesses": dict(launched),
+            "subprocess_total": sum(launched.values()),
+            "peak_rss_mb": peak_rss_mb(stage_reset),
+        }
+        rate = self.results[stage]["mb_per_sec"]
+        print(f"⏱️ {stage:<9} {seconds:8.2f}s  {files:>7} files  "
+              f"{self.results[stage]['files_per_sec'] or 0:>9.1f} files/s  "
+              f"{f'{rate:.2f}' if rate is not None else '-':>8} MB/s  {sum(launched.values()):>6} subprocesses")
+        return value
+
+
+def folder_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def run_multi_device(args, workdir, server_url, timer, sync_devices, generate_device, quiet):
+    """Sync several fake phones at once through sync_devices.
+
+    With more than one device attached, the fake adb rejects any call that isn't pinned with -s,
+    so a missing serial shows up as failed pulls; every device must also stage into its own folder.
+    """
+    serials = [f"BENCH{i + 2:04d}" for i in range(args.multi_device)]
+    generated = {}
+    for i, serial in enumerate(serials):
+        paths, files, nbytes = generate_device(
+            os.path.join(workdir, "devices", serial), small_files=args.small_files // 4 or 1,
+            small_size=args.small_size * 1024, large_files=0, large_size=0, seed=args.seed + i + 1
+        )
+        generated[serial] = {"paths": paths, "files": files, "bytes": nbytes}
+
+    config = {
+        "immich_url": server_url, "api_key": "bench-key",
+        "temp_import_dir": os.path.join(workdir, "multi", "staging"),
+        "devices": {serial: {"phone_media_paths": info["paths"]} for serial, info in generated.items()},
+    }
+    results = timer.run("multi_sync", lambda: sync_devices(serials, config, logger=quiet),
+                        files=lambda results: sum(len(r["pulled_paths"]) for r in results.values()),
+                        nbytes=sum(info["bytes"] for info in generated.values()))
+
+    devices = {}
+    for serial, result in results.items():
+        staging_dir = result.get("staging_dir") or ""
+        misplaced = [entry["local_path"] for entry in result["manifest"].values()
+                     if entry["local_path"] and not entry["local_path"].startswith(staging_dir + os.sep)]
+        devices[serial] = {
+            "error": result.get("error"),
+            "phone_files": generated[serial]["files"],
+            "pulled": len(result["pulled_paths"]),
+            "uploaded": result.get("stats", {}).get("uploaded"),
+            "misplaced": len(misplaced),
+        }
+        ok = not result.get("error") and not misplaced and devices[serial]["pulled"] == generated[serial]["files"]
+        print(f"{'✅' if ok else '❌'} {serial}: {devices[serial]['pulled']}/{generated[serial]['files']} pulled, "
+              f"{devices[serial]['uploaded']} uploaded, {len(misplaced)} staged outside its own folder"
+              + (f", error: {result['error']}" if result.get("error") else ""))
+    return devices
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n📊 Compared with {baseline_path} ({baseline.get('timestamp', '?')}):")
+    for stage, current in results["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if not old or not old.get("seconds"):
+            continue
+        change = (current["seconds"] - old["seconds"]) / old["seconds"] * 100
+        print(f"🔹 {stage:<9} {old['seconds']:8.2f}s -> {current['seconds']:8.2f}s ({change:+.1f}%)  "
+              f"subprocesses {old.get('subprocess_total')} -> {current['subprocess_total']}")
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="immich_bench_")
+    device_root = os.path.join(workdir, "devices", SERIAL)
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(bin_dir)
+    tool_log = os.path.join(workdir, "tools.log")
+
+    # The fake tools must be wired up before utils.mtp_utils reads the environment
+    os.environ["FAKE_ADB_ROOT"] = os.path.join(workdir, "devices")
+    os.environ["FAKE_TOOL_LOG"] = tool_log
+    os.environ["FAKE_ADB_LATENCY"] = str(args.adb_latency)
+    os.environ["FAKE_ADB_BANDWIDTH"] = str(args.usb_bandwidth)
+    os.environ["FAKE_EXIFTOOL_LATENCY"] = str(args.exiftool_latency)
+    os.environ["IMMICH_SYNC_ADB"] = write_wrapper(bin_dir, "adb", os.path.join(BENCH_DIR, "fake_adb.py"))
+    os.environ["IMMICH_SYNC_EXIFTOOL"] = write_wrapper(bin_dir, "exiftool", os.path.join(BENCH_DIR, "fake_exiftool.py"))
+
+    from benchmarks.fake_immich import FakeImmichServer
+    from benchmarks.media_gen import generate_device
+    from utils import metrics
+    from utils.file_utils import compress_backup
+    from utils.immich_api import create_session, upload_media_folder
+    from utils.mtp_utils import pull_media_from_phone, delete_files_from_phone
+    from utils.schedule_utils import BandwidthLimiter, parse_rate
+    from utils.state_utils import HashIndex
+    from utils.sync_utils import sync_devices, verify_pulled_on_server
+
+    print(f"🧪 Generating synthetic phone in {device_root}")
+    phone_paths, total_files, total_bytes = generate_device(
+        device_root, small_files=args.small_files, small_size=args.small_size * 1024,
+        large_files=args.large_files, large_size=args.large_size * 1024 * 1024, seed=args.seed
+    )
+    print(f"📱 {total_files} media files, {total_bytes / 1e6:.1f} MB")
+
+    staging_dir = os.path.join(workdir, "backup", SERIAL)
+    quiet = (lambda msg: None) if not args.verbose else print
+    timer = StageTimer(tool_log)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with FakeImmichServer(latency=args.server_latency) as server:
+            manifest = {}
+            pulled = timer.run("pull", lambda: pull_media_from_phone(
+                staging_dir, logger=quiet, serial=SERIAL, paths=phone_paths,
+                hash_index=HashIndex(os.path.join(workdir, "seen_hashes.json")), manifest=manifest
+            ), files=len, nbytes=total_bytes)
+
+            session = create_session(pool_size=args.upload_workers + 2)
+            limiter = BandwidthLimiter(parse_rate(args.upload_limit)) if args.upload_limit else None
+            executor = ThreadPoolExecutor(max_workers=args.upload_workers) if args.upload_workers > 1 else None
+            staged_bytes = folder_bytes(staging_dir)
+            timer.run("upload", lambda: upload_media_folder(
+                staging_dir, server.url, "bench-key", logger=quiet, executor=executor, session=session,
+                order=args.upload_order, limiter=limiter
+            ), files=lambda stats: stats["total"], nbytes=staged_bytes)
+            if executor:
+                executor.shutdown()
+            session.close()
+            http_requests = dict(server.state.requests)
+
+            timer.run("compress", lambda: compress_backup(
+                staging_dir, logger=quiet, archive_dir=workdir, label=SERIAL
+            ), files=len(pulled), nbytes=staged_bytes)
+
+            config = {"immich_url": server.url, "api_key": "bench-key"}
+            verified, unverified = timer.run("verify", lambda: verify_pulled_on_server(
+                {"pulled_paths": pulled, "manifest": manifest}, config
+            ), files=len(pulled))
+            timer.run("delete", lambda: delete_files_from_phone(verified, logger=quiet, serial=SERIAL),
+                      files=len(verified))
+
+            if args.multi_device:
+                multi = run_multi_device(args, workdir, server.url, timer, sync_devices, generate_device, quiet)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "dataset": {"files": total_files, "bytes": total_bytes},
+        "http_requests": http_requests,
+        "multi_device": multi if args.multi_device else None,
+        "stages": timer.results,
+        "latencies": metrics.METRICS.summary()["latencies"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync pipeline against fake adb, exiftool and Immich.")
+    parser.add_argument("--small-files", type=int, default=500, help="Number of small JPEGs")
+    parser.add_argument("--small-size", type=int, default=200, help="Mean small JPEG size in KB")
+    parser.add_argument("--large-files", type=int, default=2, help="Number of large MP4s")
+    parser.add_argument("--large-size", type=int, default=64, help="Large MP4 size in MB")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--upload-order", default="walk", help="walk, smallest_first, newest_first or photos_first")
+    parser.add_argument("--upload-limit", help="Upload bandwidth cap, e.g. 2MB (default: unlimited)")
+    parser.add_argument("--server-latency", type=float, default=0.005, help="Seconds added to every HTTP request")
+    parser.add_argument("--adb-latency", type=float, default=0.0, help="Seconds added to every adb call")
+    parser.add_argument("--usb-bandwidth", type=float, default=0, help="Bytes/sec cap for adb pull (0 = unlimited)")
+    parser.add_argument("--exiftool-latency", type=float, default=0.0, help="Seconds added to every exiftool call")
+    parser.add_argument("--multi-device", type=int, default=2,
+                        help="Extra fake phones synced together through sync_devices afterwards (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log output")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, simpledialog, messagebox
 import json
-import subprocess
 import threading
 import os
 import sys
-from utils.mtp_utils import pull_media_from_phone, delete_files_from_phone
-from utils.immich_api import upload_file_to_immich, get_or_create_album, add_asset_to_album
-from utils.file_utils import compress_backup
-
-NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform.startswith("win") else 0
+from utils.mtp_utils import (
+    list_connected_devices,
+    list_phone_folder,
+    load_folder_cache,
+    save_folder_cache
+)
+from utils.sync_utils import (
+    sync_devices, delete_verified_from_phone, cleanup_after_sync, write_metrics, backup_root_dir
+)
+from utils.profile_utils import RunProfiler
+from utils.plan_utils import plan_sync, format_plan
+from utils import metrics
+from utils.cancel_utils import CancelToken, CancelledError
+from utils.log_utils import BufferedLogSink
+from utils.progress_utils import progress_fraction, format_progress, format_bytes
+
+LOG_DRAIN_MS = 100
+LOG_MAX_LINES = 2000
+PHONE_ROOT = "/sdcard"
 
 def check_dependencies():
     missing = []
@@ -28,10 +41,6 @@ def check_dependencies():
     return True
 
 
-def run_quiet(cmd, **kwargs):
-    return subprocess.run(cmd, creationflags=NO_WINDOW, **kwargs)
-
-
 class PhoneBackupGUI:
     def __init__(self, root):
         self.root = root
@@ -54,8 +63,16 @@ class PhoneBackupGUI:
         self.pulled_paths = []
         self.current_backup_dir = ""
         self.backup_thread = None
+        self.cancel_token = None
+        self.latest_progress = None
+        self.rendered_progress = None
+        self.device_serial, self.folder_listings = load_folder_cache()
+        self.folder_lock = threading.Lock()
+        self.log_sink = BufferedLogSink()
         self.create_widgets()
+        self.root.after(LOG_DRAIN_MS, self.drain_log)
         self.refresh_selected_paths()
+        self.show_folder_listing('', PHONE_ROOT)
         threading.Thread(target=self.refresh_phone_folders, daemon=True).start()
 
     def load_config(self):
@@ -132,11 +149,16 @@ class PhoneBackupGUI:
         ttk.Button(frame, text="Refresh Folders", 
                   command=lambda: threading.Thread(target=self.refresh_phone_folders, daemon=True).start()
         ).pack(side='left')
-        self.folders_tree = ttk.Treeview(parent, columns=('path',), show='tree headings')
+        self.folders_tree = ttk.Treeview(parent, columns=('path', 'media', 'size'), show='tree headings')
         self.folders_tree.heading('#0', text='Folder')
         self.folders_tree.heading('path', text='Full Path')
-        self.folders_tree.column('#0', width=300)
+        self.folders_tree.heading('media', text='Media Files')
+        self.folders_tree.heading('size', text='Size')
+        self.folders_tree.column('#0', width=220)
+        self.folders_tree.column('media', width=90, anchor='e')
+        self.folders_tree.column('size', width=90, anchor='e')
         self.folders_tree.pack(fill='both', expand=True, padx=10, pady=5)
+        self.folders_tree.bind('<<TreeviewOpen>>', self.on_folder_open)
         self.selected_listbox = tk.Listbox(parent, height=8)
         self.selected_listbox.pack(fill='x', padx=10, pady=5)
         ttk.Button(parent, text="Add Selected", command=self.add_selected_folder).pack(side='left', padx=10, pady=5)
@@ -147,6 +169,9 @@ class PhoneBackupGUI:
         ttk.Label(parent, text="Custom Album Name (optional):").pack(anchor='w', padx=10)
         self.custom_album_var = tk.StringVar()
         ttk.Entry(parent, textvariable=self.custom_album_var, width=40).pack(anchor='w', padx=10, pady=(0, 10))
+        self.profile_var = tk.BooleanVar()
+        ttk.Checkbutton(parent, text="Profile this run (slower; writes a CPU/memory report next to the backup folder)",
+                        variable=self.profile_var).pack(anchor='w', padx=10, pady=(0, 10))
         self.progress_var = tk.StringVar(value="Ready to start backup...")
         ttk.Label(parent, textvariable=self.progress_var).pack(anchor='w', padx=10)
         self.progress_bar = ttk.Progressbar(parent, mode='indeterminate')
@@ -157,82 +182,150 @@ class PhoneBackupGUI:
         btn_frame.pack(fill='x', padx=10)
         self.start_button = ttk.Button(btn_frame, text="Start Backup", command=self.start_backup_process)
         self.start_button.pack(side='left')
+        self.plan_button = ttk.Button(btn_frame, text="Dry Run", command=self.start_plan)
+        self.plan_button.pack(side='left', padx=(5, 0))
         self.stop_button = ttk.Button(btn_frame, text="Stop", command=self.stop_process, state='disabled')
         self.stop_button.pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Clear Log", command=self.clear_log).pack(side='right')
 
     def log_message(self, msg):
-        self.root.after(0, lambda: (self.log_text.insert(tk.END, msg + "\n"), self.log_text.see(tk.END)))
+        self.log_sink.write(msg)
+
+    def drain_log(self):
+        try:
+            lines = self.log_sink.drain()
+            if lines:
+                self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+                line_count = int(self.log_text.index('end-1c').split('.')[0])
+                if line_count > LOG_MAX_LINES:
+                    self.log_text.delete(1.0, f"{line_count - LOG_MAX_LINES}.0")
+                self.log_text.see(tk.END)
+            self.render_progress()
+        finally:
+            self.root.after(LOG_DRAIN_MS, self.drain_log)
+
+    def on_progress(self, event):
+        # Called from worker threads; the Tk thread picks it up on its next drain tick
+        self.latest_progress = event
+
+    def render_progress(self):
+        event = self.latest_progress
+        if event is None or event is self.rendered_progress:
+            return
+        self.rendered_progress = event
+
+        fraction = progress_fraction(event)
+        if fraction is None:
+            if str(self.progress_bar['mode']) != 'indeterminate':
+                self.progress_bar.config(mode='indeterminate')
+                self.progress_bar.start()
+        else:
+            if str(self.progress_bar['mode']) != 'determinate':
+                self.progress_bar.stop()
+                self.progress_bar.config(mode='determinate', maximum=100)
+            self.progress_bar['value'] = fraction * 100
+        self.progress_var.set(format_progress(event))
+
+    def finish_progress(self):
+        self.rendered_progress = self.latest_progress
+        self.progress_bar.stop()
+        self.progress_var.set("Backup process finished")
 
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
 
     def start_backup_process(self):
         self.start_button.config(state='disabled')
+        self.plan_button.config(state='disabled')
         self.stop_button.config(state='normal')
+        self.progress_bar.config(mode='indeterminate', value=0)
         self.progress_bar.start()
         self.progress_var.set("Starting backup...")
-        self.backup_thread = threading.Thread(target=self.run_backup_process, daemon=True)
+        self.latest_progress = None
+        self.rendered_progress = None
+        self.cancel_token = CancelToken()
+        target = self.run_profiled_backup if self.profile_var.get() else self.run_backup_process
+        self.backup_thread = threading.Thread(target=target, args=(self.cancel_token,), daemon=True)
         self.backup_thread.start()
 
-    def run_backup_process(self):
+    def start_plan(self):
+        self.start_button.config(state='disabled')
+        self.plan_button.config(state='disabled')
+        self.stop_button.config(state='normal')
+        self.progress_var.set("Planning...")
+        self.cancel_token = CancelToken()
+        threading.Thread(target=self.run_plan, args=(self.cancel_token,), daemon=True).start()
+
+    def run_plan(self, cancel):
         try:
-            backup_dir = self.config["temp_import_dir"]
-            immich_url = self.config["immich_url"]
-            api_key = self.config["api_key"]
-            self.log_message("📥 Pulling files from phone…")
-            pulled = pull_media_from_phone(destination=backup_dir, logger=self.log_message)
+            serials = list_connected_devices()
+            if not serials:
+                self.log_message("❌ No phone connected")
+                return
+            plan = plan_sync(serials, self.config, logger=self.log_message, cancel=cancel)
+            for line in format_plan(plan):
+                self.log_message(line)
+        except CancelledError:
+            self.log_message("🛑 Dry run stopped.")
+        except Exception as e:
+            self.log_message(f"❌ Dry run failed: {e}")
+        finally:
+            self.root.after(0, lambda: self.progress_var.set("Dry run finished"))
+            self.root.after(0, lambda: self.start_button.config(state='normal'))
+            self.root.after(0, lambda: self.plan_button.config(state='normal'))
+            self.root.after(0, lambda: self.stop_button.config(state='disabled'))
+
+    def run_profiled_backup(self, cancel):
+        with RunProfiler(backup_root_dir(self.config), logger=self.log_message):
+            self.run_backup_process(cancel)
+
+    def run_backup_process(self, cancel):
+        try:
+            serials = list_connected_devices()
+            if not serials:
+                self.log_message("❌ No phone connected")
+                return
             album = self.custom_album_var.get().strip()
-            stats = {"total": 0, "uploaded": 0, "duplicates": 0, "failed": 0}
-            self.log_message("🚀 Uploading to Immich…")
-            for root, _, files in os.walk(backup_dir):
-                for fn in files:
-                    if not fn.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov", ".heic", ".gif")):
-                        continue
-                    stats["total"] += 1
-                    path = os.path.join(root, fn)
-                    self.log_message(f"📤 Uploading: {path}")
-                    asset_id, status = upload_file_to_immich(path, immich_url, api_key, logger=self.log_message)
-                    if not asset_id:
-                        stats["failed"] += 1
-                        continue
-
-                    parts = os.path.basename(root).split("_")
-                    alb = album or "_".join(parts[2:]) if len(parts) > 2 else parts[1] if len(parts) > 1 else parts[0]
-                    album_id = get_or_create_album(alb, immich_url, api_key)
-                    if album_id:
-                        added = add_asset_to_album(asset_id, album_id, immich_url, api_key)
-                        self.log_message(f"📁 Added to album '{alb}': {added}")
-                    if status == "duplicate":
-                        stats["duplicates"] += 1
-                        self.log_message("♻️ File already exists in Immich (duplicate).")
-                    else:
-                        stats["uploaded"] += 1
-            compress_backup(backup_dir, logger=self.log_message)
-            self.log_message("\n📊 Sync Summary:")
-            for k, v in stats.items():
-                self.log_message(f"🔹 {k.capitalize()}: {v}")
+            self.log_message(f"📥 Syncing {len(serials)} device(s): {', '.join(serials)}")
+            metrics.METRICS.reset()
+            results = sync_devices(serials, self.config, custom_album=album, logger=self.log_message,
+                                   cancel=cancel, progress=self.on_progress)
+            for serial, result in results.items():
+                self.log_message(f"\n📊 Sync Summary ({serial}):")
+                if "error" in result:
+                    self.log_message(f"❌ Sync failed: {result['error']}")
+                    continue
+                for k, v in result["stats"].items():
+                    self.log_message(f"🔹 {k.capitalize()}: {v}")
             self.log_message("")
-            self.ask_cleanup(pulled, backup_dir)
+            self.ask_cleanup(results, cancel)
+        except CancelledError:
+            self.log_message("🛑 Backup stopped. Already processed files are kept; run again to resume.")
         except Exception as e:
             self.log_message(f"❌ Backup failed: {e}")
         finally:
-            self.root.after(0, self.progress_bar.stop)
+            write_metrics(self.config, logger=self.log_message)
+            self.root.after(0, self.finish_progress)
             self.root.after(0, lambda: self.start_button.config(state='normal'))
+            self.root.after(0, lambda: self.plan_button.config(state='normal'))
             self.root.after(0, lambda: self.stop_button.config(state='disabled'))
-            self.progress_var.set("Backup process finished")
 
-    def ask_cleanup(self, pulled_paths, backup_dir):
+    def ask_cleanup(self, results, cancel=None):
         def ask_and_handle():
-            if messagebox.askyesno("Cleanup", "🗑️ Delete pulled files from phone?"):
-                delete_files_from_phone(pulled_paths, logger=self.log_message)
-            if messagebox.askyesno("Cleanup", "🧹 Delete pulled files from PC (they're now zipped)?\n⚠️ This will delete the local backup folder!"):
-                import shutil
+            if messagebox.askyesno("Cleanup", "🗑️ Delete synced files from phone?\nOnly files confirmed on the Immich server are deleted."):
+                self.root.after(0, lambda: self.stop_button.config(state='normal'))
                 try:
-                    shutil.rmtree(backup_dir)
-                    self.log_message("\n🗑️ Local pulled media folder deleted.")
-                except Exception as e:
-                    self.log_message(f"❌ Failed to delete local: {e}")
+                    delete_verified_from_phone(results, self.config, logger=self.log_message, cancel=cancel,
+                                               progress=self.on_progress)
+                except CancelledError:
+                    self.log_message("🛑 Phone cleanup stopped.")
+                finally:
+                    self.root.after(0, lambda: self.stop_button.config(state='disabled'))
+            if messagebox.askyesno("Cleanup", "🧹 Delete pulled files from PC (they're now zipped)?\n⚠️ This will delete the local backup folder!"):
+                # Per device, so a device whose sync failed keeps its staged files for the next run
+                cleanup_after_sync(results, self.config, delete_local=True, logger=self.log_message)
+            # Refresh the run summary so it includes the phone cleanup
+            write_metrics(self.config, logger=self.log_message)
         threading.Thread(target=ask_and_handle, daemon=True).start()
 
     def select_backup_directory(self):
@@ -270,37 +363,72 @@ class PhoneBackupGUI:
     def refresh_phone_folders(self):
         self.root.after(0, lambda: self.phone_status.config(text="🔄 Scanning phone..."))
         try:
-            result = run_quiet(["adb", "devices"], capture_output=True, text=True)
-            if "device" not in result.stdout or len(result.stdout.strip().split('\n')) < 2:
-                self.root.after(0, lambda: self.phone_status.config(text="❌ No phone connected"))
-                return
+            serials = list_connected_devices()
         except FileNotFoundError:
             self.root.after(0, lambda: self.phone_status.config(text="❌ ADB not found"))
             return
+        if not serials:
+            self.root.after(0, lambda: self.phone_status.config(text="❌ No phone connected"))
+            return
+
+        serial = serials[0]
+        with self.folder_lock:
+            if serial != self.device_serial:
+                self.device_serial, self.folder_listings = load_folder_cache(serial)
+                self.root.after(0, self.reset_folder_tree)
+            # Refresh the root plus every folder the user has already expanded, one adb call each
+            stale = [PHONE_ROOT] + sorted(path for path in self.folder_listings if path != PHONE_ROOT)
 
-        common_dirs = [
-            "/sdcard/DCIM", "/sdcard/Pictures", "/sdcard/Download",
-            "/sdcard/Camera", "/sdcard/WhatsApp/Media"
-        ]
-        found = []
-        for d in common_dirs:
-            try:
-                res = run_quiet(["adb", "shell", "find", d, "-maxdepth", "2", "-type", "d"],
-                                capture_output=True, text=True, timeout=10)
-                if res.returncode == 0:
-                    for line in res.stdout.strip().split('\n'):
-                        if line and line not in found:
-                            found.append(line)
-            except Exception:
-                continue
-        self.root.after(0, self.folders_tree.delete, *self.folders_tree.get_children())
-        for f in sorted(found):
-            self.root.after(0, lambda folder=f: self.folders_tree.insert('', 'end',
-                                                                         text=os.path.basename(folder) or folder,
-                                                                         values=(folder,)))
-        self.root.after(0, lambda: self.phone_status.config(text=f"✅ Found {len(found)} folders"))
+        for path in stale:
+            self.load_phone_folder(path)
+
+        self.root.after(0, lambda: self.phone_status.config(
+            text=f"✅ {serial}: {len(self.folder_listings.get(PHONE_ROOT, []))} folders"))
         self.root.after(0, self.refresh_selected_paths)
 
+    def load_phone_folder(self, path):
+        entries = list_phone_folder(path, serial=self.device_serial)
+        if entries is None:
+            return
+        with self.folder_lock:
+            self.folder_listings[path] = entries
+            save_folder_cache(self.device_serial, self.folder_listings)
+        self.root.after(0, self.show_folder_listing, '' if path == PHONE_ROOT else path, path)
+
+    def reset_folder_tree(self):
+        self.folders_tree.delete(*self.folders_tree.get_children())
+        self.show_folder_listing('', PHONE_ROOT)
+
+    def show_folder_listing(self, parent_iid, parent_path):
+        entries = self.folder_listings.get(parent_path)
+        if entries is None or (parent_iid and not self.folders_tree.exists(parent_iid)):
+            return
+
+        wanted = set()
+        for name, count, size, has_children in entries:
+            path = f"{parent_path.rstrip('/')}/{name}"
+            wanted.add(path)
+            values = (path, count, format_bytes(size))
+            if self.folders_tree.exists(path):
+                self.folders_tree.item(path, values=values)
+            else:
+                self.folders_tree.insert(parent_iid, 'end', iid=path, text=name, values=values)
+            if has_children and not self.folders_tree.get_children(path):
+                self.folders_tree.insert(path, 'end', text="Loading…", tags=('placeholder',))
+            self.show_folder_listing(path, path)
+
+        for child in self.folders_tree.get_children(parent_iid):
+            if child not in wanted:
+                self.folders_tree.delete(child)
+        for index, path in enumerate(sorted(wanted, key=lambda p: os.path.basename(p).lower())):
+            self.folders_tree.move(path, parent_iid, index)
+
+    def on_folder_open(self, event):
+        iid = self.folders_tree.focus()
+        children = self.folders_tree.get_children(iid)
+        if children and 'placeholder' in self.folders_tree.item(children[0], 'tags'):
+            threading.Thread(target=self.load_phone_folder, args=(iid,), daemon=True).start()
+
     def add_selected_folder(self):
         sel = self.folders_tree.selection()
         if not sel:
@@ -341,6 +469,9 @@ class PhoneBackupGUI:
 
     def stop_process(self):
         self.log_message("🛑 Stop requested by user")
+        self.stop_button.config(state='disabled')
+        if self.cancel_token:
+            self.cancel_token.cancel()
 
 
 def main():
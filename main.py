@@ -1,95 +1,234 @@
-import os
 import json
-from utils.immich_api import (
-    upload_file_to_immich,
-    get_or_create_album,
-    add_asset_to_album
-)
-from utils.file_utils import compress_backup
-from utils.mtp_utils import pull_media_from_phone, delete_files_from_phone
-
-# Load config
-with open("config.json") as f:
-    config = json.load(f)
-
-IMMICH_URL = config["immich_url"]
-API_KEY = config["api_key"]
-BACKUP_DIR = config["temp_import_dir"]
-
-
-def process_media():
-    print("📥 Pulling files from phone...")
-    pulled_paths = pull_media_from_phone(destination=BACKUP_DIR)
-
-    custom_album = input("🎨 Do you want to use a custom album name for this run? (leave blank to auto-detect): ").strip()
-
-    print("🚀 Starting upload process...")
-    stats = {
-        "total": 0,
-        "uploaded": 0,
-        "duplicates": 0,
-        "failed": 0
+import argparse
+import threading
+from contextlib import nullcontext
+from utils import metrics
+from utils.cancel_utils import CancelToken, CancelledError
+from utils.immich_api import bootstrap_server_index
+from utils.log_utils import console
+from utils.mtp_utils import list_connected_devices
+from utils.plan_utils import plan_sync, format_plan
+from utils.profile_utils import RunProfiler
+from utils.progress_utils import ConsoleProgress
+from utils.state_utils import ServerIndex
+from utils.sync_utils import SyncContext, sync_devices, cleanup_after_sync, run_daemon, write_metrics, backup_root_dir
+
+
+def load_config(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def ask_yes_no(question):
+    return input(question).strip().lower() == "y"
+
+
+def resolve_policy(args, config):
+    """Flags win over config.json; anything left as None is asked interactively"""
+    policy = {
+        "custom_album": config.get("custom_album"),
+        "delete_from_phone": config.get("delete_from_phone"),
+        "delete_local": config.get("delete_local"),
     }
-
-    for root, _, files in os.walk(BACKUP_DIR):
-        for file in files:
-            if file.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov", ".heic", ".gif")):
-                stats["total"] += 1
-                full_path = os.path.join(root, file)
-                print(f"📤 Uploading: {full_path}")
-                asset_id, upload_status = upload_file_to_immich(full_path, IMMICH_URL, API_KEY)
-
-                if asset_id:
-                    if custom_album:
-                        album_name = custom_album
-                    else:
-                        parts = os.path.basename(root).split("_")
-                        album_name = "_".join(parts[2:]) if len(parts) > 2 else parts[1] if len(parts) > 1 else parts[0]
-                    album_id = get_or_create_album(album_name, IMMICH_URL, API_KEY)
-                    if album_id:
-                        added = add_asset_to_album(asset_id, album_id, IMMICH_URL, API_KEY)
-                        print(f"📁 Added to album '{album_name}': {added}")
-
-                    if upload_status == "duplicate":
-                        stats["duplicates"] += 1
-                        print("♻️ File already exists in Immich (duplicate).")
-                    else:
-                        stats["uploaded"] += 1
-                else:
-                    stats["failed"] += 1
-                    print("❌ Upload failed.")
-
-    compress_backup(BACKUP_DIR)
+    for key in policy:
+        if getattr(args, key) is not None:
+            policy[key] = getattr(args, key)
+
+    if args.non_interactive or args.daemon:
+        policy = {
+            "custom_album": policy["custom_album"] or "",
+            "delete_from_phone": bool(policy["delete_from_phone"]),
+            "delete_local": bool(policy["delete_local"]),
+        }
+    return policy
+
+
+def process_media(config, policy, serials=None, progress=None):
+    serials = serials or list_connected_devices()
+    if not serials:
+        print("❌ No phone connected")
+        return
+
+    custom_album = policy["custom_album"]
+    if custom_album is None:
+        custom_album = input("🎨 Do you want to use a custom album name for this run? (leave blank to auto-detect): ").strip()
+
+    print(f"📥 Syncing {len(serials)} device(s): {', '.join(serials)}")
+    metrics.METRICS.reset()
+    try:
+        run_and_cleanup(config, policy, serials, custom_album, progress, cancel=CancelToken())
+    except CancelledError:
+        console("🛑 Sync stopped. Already processed files are kept; run again to resume.")
+    finally:
+        write_metrics(config, logger=console)
+
+
+def run_cancellable(cancel, func, *args, **kwargs):
+    """Run func(*args, cancel=cancel, **kwargs) on a worker thread, so Ctrl+C cancels it and waits for it to stop"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["value"] = func(*args, cancel=cancel, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        console("\n🛑 Stopping…")
+        cancel.cancel()
+        worker.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    if cancel.cancelled:
+        raise CancelledError("Operation cancelled by user")
+    return outcome.get("value")
+
+
+def run_and_cleanup(config, policy, serials, custom_album, progress=None, cancel=None):
+    cancel = cancel or CancelToken()
+    results = run_cancellable(cancel, sync_devices, serials, config, custom_album=custom_album, logger=console,
+                              progress=progress)
 
     # Sync summary
-    print("\n📊 Sync Summary:")
-    print(f"🔹 Total media files found: {stats['total']}")
-    print(f"🔹 Uploaded: {stats['uploaded']}")
-    print(f"🔹 Duplicates skipped: {stats['duplicates']}")
-    print(f"🔹 Failed uploads: {stats['failed']}")
-
-    confirm = input("\n🗑️ Do you want to delete the pulled files from your phone? (y/N): ").strip().lower()
-    if confirm == "y":
-        print("🔄 Deleting pulled files from phone...")
-        delete_files_from_phone(pulled_paths)
+    for serial, result in results.items():
+        print(f"\n📊 Sync Summary ({serial}):")
+        if "error" in result:
+            print(f"❌ Sync failed: {result['error']}")
+            continue
+        stats = result["stats"]
+        print(f"🔹 Total media files found: {stats['total']}")
+        print(f"🔹 Uploaded: {stats['uploaded']}")
+        print(f"🔹 Duplicates skipped: {stats['duplicates']}")
+        print(f"🔹 Failed uploads: {stats['failed']}")
+
+    delete_from_phone = policy["delete_from_phone"]
+    if delete_from_phone is None:
+        delete_from_phone = ask_yes_no("\n🗑️ Do you want to delete the synced files from your phone? (y/N): ")
+    if delete_from_phone:
+        run_cancellable(cancel, cleanup_after_sync, results, config, delete_from_phone=True, logger=console,
+                        progress=progress)
         print("✅ Done deleting from phone.")
     else:
         print("❎ Skipped deletion.")
 
     # Ask about deleting pulled files from PC
-    confirm_pc = input(
-        "\n🧹 Do you want to delete the pulled files from your PC (they're now zipped)? (y/N): ").strip().lower()
-    if confirm_pc == "y":
-        import shutil
-        try:
-            shutil.rmtree(BACKUP_DIR)
-            print("🗑️ Local pulled media folder deleted successfully.")
-        except Exception as e:
-            print(f"❌ Failed to delete local folder: {e}")
+    delete_local = policy["delete_local"]
+    if delete_local is None:
+        delete_local = ask_yes_no("\n🧹 Do you want to delete the pulled files from your PC (they're now zipped)? (y/N): ")
+    if delete_local:
+        run_cancellable(cancel, cleanup_after_sync, results, config, delete_local=True, logger=console)
     else:
         print("📁 Pulled media left in place.")
 
 
+def plan_media(config, serials=None):
+    serials = serials or list_connected_devices()
+    if not serials:
+        print("❌ No phone connected")
+        return
+    try:
+        plan = plan_sync(serials, config, logger=console)
+    except KeyboardInterrupt:
+        print("\n🛑 Planning stopped.")
+        return
+    for line in format_plan(plan):
+        print(line)
+
+
+def bootstrap_index(config, rebuild=False, progress=None):
+    index = ServerIndex.for_server(config["immich_url"])
+    if rebuild:
+        index.clear()
+    try:
+        bootstrap_server_index(index, config["immich_url"], config["api_key"], progress=progress)
+    except KeyboardInterrupt:
+        print(f"\n⏸️ Stopped with {len(index)} assets indexed; run --bootstrap again to resume.")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pull media from Android phones over ADB and upload it to Immich.")
+    parser.add_argument("--config", default="config.json", help="Path to config.json")
+    parser.add_argument("--album", dest="custom_album", help="Album name for this run (default: from folder names)")
+    parser.add_argument("--delete-from-phone", dest="delete_from_phone", action="store_true", default=None,
+                        help="Delete synced files from the phone after syncing")
+    parser.add_argument("--keep-on-phone", dest="delete_from_phone", action="store_false",
+                        help="Never delete synced files from the phone")
+    parser.add_argument("--delete-local", dest="delete_local", action="store_true", default=None,
+                        help="Delete the local staging copies after they are archived")
+    parser.add_argument("--keep-local", dest="delete_local", action="store_false",
+                        help="Keep the local staging copies")
+    parser.add_argument("-y", "--non-interactive", action="store_true",
+                        help="Never prompt; unset options fall back to config.json, then to keeping files")
+    parser.add_argument("--device", dest="devices", action="append", metavar="SERIAL",
+                        help="Only sync this device (repeatable); in daemon mode, adds a known device")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Stay running and sync known devices automatically whenever they connect")
+    parser.add_argument("--no-progress", action="store_true", help="Disable the console progress line")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="Index the assets already on the Immich server, then exit (resumable; re-run to refresh)")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="With --bootstrap, discard the local server index and start over")
+    parser.add_argument("--plan", action="store_true",
+                        help="Dry run: list what a sync would pull and upload, with a time estimate, then exit")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU, memory and subprocess launches; reports go next to the backup directory")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    config = load_config(args.config)
+    policy = resolve_policy(args, config)
+    progress = None if args.no_progress or args.daemon else ConsoleProgress(console=console)
+
+    profiler = nullcontext()
+    if args.profile:
+        profiler = RunProfiler(backup_root_dir(config), label="daemon" if args.daemon else "sync")
+    with profiler:
+        run(args, config, policy, progress)
+
+
+def run(args, config, policy, progress=None):
+    if args.bootstrap:
+        bootstrap_index(config, rebuild=args.rebuild_index, progress=progress)
+        return
+
+    if args.plan:
+        plan_media(config, serials=args.devices)
+        return
+
+    if not args.daemon:
+        process_media(config, policy, serials=args.devices, progress=progress)
+        return
+
+    known_serials = set(args.devices or []) | set(config.get("known_devices", [])) | set(config.get("devices", {}))
+    if not known_serials:
+        print("❌ No known devices: add serials to \"known_devices\" in config.json or pass --device SERIAL")
+        return
+
+    cancel = CancelToken()
+    with SyncContext(config) as context:
+        daemon = threading.Thread(target=run_daemon, args=(context, known_serials), kwargs={
+            "custom_album": policy["custom_album"],
+            "delete_from_phone": policy["delete_from_phone"],
+            "delete_local": policy["delete_local"],
+            "logger": console,
+            "cancel": cancel,
+        })
+        daemon.start()
+        try:
+            while daemon.is_alive():
+                daemon.join(0.5)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping daemon…")
+            cancel.cancel()
+            daemon.join()
+
 
 if __name__ == "__main__":
-    process_media()
+    main()
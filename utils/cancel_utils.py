@@ -0,0 +1,50 @@
+import threading
+
+
+class CancelledError(Exception):
+    pass
+
+
+class CancelToken:
+    """Cooperative cancellation flag shared between the UI and the worker threads"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            processes = list(self._processes)
+        for proc in processes:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise CancelledError("Operation cancelled by user")
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    def track_process(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+        if self._event.is_set():
+            proc.kill()
+
+    def untrack_process(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+
+def check_cancelled(cancel):
+    if cancel is not None:
+        cancel.raise_if_cancelled()
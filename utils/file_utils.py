@@ -2,6 +2,11 @@ import os
 import shutil
 import zipfile
 from datetime import datetime
+from utils import metrics
+from utils.cancel_utils import CancelledError, check_cancelled
+from utils.progress_utils import ProgressTracker
+
+MEDIA_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov", ".heic", ".gif")
 
 def backup_file(src_path, source_root, backup_root, logger=print):
     relative_path = os.path.relpath(src_path, source_root)
@@ -11,25 +16,83 @@ def backup_file(src_path, source_root, backup_root, logger=print):
     shutil.copy2(src_path, dest_path)  # keeps metadata
     logger(f"💾 Backed up: {relative_path}")
 
-def compress_backup(backup_root, logger=print):
+def write_file_to_zip(zipf, full_path, arcname, cancel=None, chunk_size=1024 * 1024):
+    with metrics.timer("archive_write_seconds"):
+        _write_file_to_zip(zipf, full_path, arcname, cancel=cancel, chunk_size=chunk_size)
+    metrics.inc("archive_bytes_total", os.path.getsize(full_path))
+
+def _write_file_to_zip(zipf, full_path, arcname, cancel=None, chunk_size=1024 * 1024):
+    if cancel is None:
+        zipf.write(full_path, arcname)
+        return
+
+    # Stream in chunks so a cancel request is honoured even in the middle of a huge video
+    zinfo = zipfile.ZipInfo.from_file(full_path, arcname)
+    zinfo.compress_type = zipf.compression
+    zinfo._compresslevel = zipf.compresslevel
+    with open(full_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            check_cancelled(cancel)
+            dest.write(chunk)
+
+def compress_backup(backup_root, logger=print, cancel=None, progress=None, archive_dir=None, label=None, files=None):
+    """Zip backup_root (or only files under it) into a new archive; returns its path, or None if there was nothing"""
+    if files is None:
+        files = [os.path.join(root, file) for root, _, names in os.walk(backup_root) for file in names]
+    to_archive = [(full_path, os.path.getsize(full_path)) for full_path in files if os.path.exists(full_path)]
+    if not to_archive:
+        logger("🗜️ Nothing new to archive.")
+        return None
+
     date_str = datetime.now().strftime("%Y-%m-%d_%H%M")
-    zip_path = os.path.join(os.path.dirname(backup_root), f"ImmichBackup_{date_str}.zip")
+    archive_name = f"ImmichBackup_{label}_{date_str}" if label else f"ImmichBackup_{date_str}"
+    zip_path = unused_path(os.path.join(archive_dir or os.path.dirname(backup_root), archive_name), ".zip")
+
+    tracker = ProgressTracker("compress", progress, total_files=len(to_archive),
+                              total_bytes=sum(size for _, size in to_archive))
 
     logger(f"\n🗜️ Compressing backup to: {zip_path}")
-    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
-        for root, _, files in os.walk(backup_root):
-            for file in files:
-                full_path = os.path.join(root, file)
+    try:
+        # Exclusive create: two syncs in the same minute must never replace each other's archive
+        with zipfile.ZipFile(zip_path, 'x', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
+            for full_path, size in to_archive:
+                check_cancelled(cancel)
                 arcname = os.path.relpath(full_path, backup_root)
-                zipf.write(full_path, arcname)
+                write_file_to_zip(zipf, full_path, arcname, cancel=cancel)
+                tracker.advance(files=1, nbytes=size)
+    except CancelledError:
+        # A partial archive is worse than none; the pulled files are still on disk
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        logger("🛑 Compression cancelled, partial archive removed.")
+        raise
+    tracker.finish()
     logger("✅ Backup compressed.")
+    return zip_path
+
+
+def unused_path(base, ext):
+    """base + ext, or base_2 + ext, base_3 + ext, ... whichever does not exist yet"""
+    path, n = base + ext, 1
+    while os.path.exists(path):
+        n += 1
+        path = f"{base}_{n}{ext}"
+    return path
 
 import hashlib
 
-def compute_file_hash(filepath, chunk_size=65536):
-    sha256 = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(chunk_size), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()
+def compute_file_hash(filepath, chunk_size=65536, algorithm="sha256"):
+    return compute_file_hashes(filepath, (algorithm,), chunk_size)[algorithm]
 
+def compute_file_hashes(filepath, algorithms=("sha256", "sha1"), chunk_size=65536):
+    """Several digests of one file in a single read, as {algorithm: hexdigest}"""
+    digests = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    label = "+".join(algorithms)
+    nbytes = 0
+    with metrics.timer("hash_seconds", algorithm=label), open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            for digest in digests.values():
+                digest.update(chunk)
+            nbytes += len(chunk)
+    metrics.inc("hashed_bytes_total", nbytes, algorithm=label)
+    return {algorithm: digest.hexdigest() for algorithm, digest in digests.items()}
@@ -1,15 +1,85 @@
+import os
+import uuid
+import base64
+import threading
+from datetime import datetime, timezone
 import requests
+from utils import metrics
+from utils.cancel_utils import CancelledError, check_cancelled
+from utils.file_utils import MEDIA_EXTS, compute_file_hash
+from utils.progress_utils import ProgressTracker
+from utils.schedule_utils import order_uploads
 
-def upload_file_to_immich(file_path, immich_url, api_key, logger=print):
-    import os
-    import requests
+
+class MultipartFileStream:
+    """multipart/form-data body streamed from disk, checking for cancellation between chunks"""
+
+    def __init__(self, fields, file_field, file_path, cancel=None, on_chunk=None, chunk_size=256 * 1024,
+                 throttle=None):
+        self.file_path = file_path
+        self.cancel = cancel
+        self.on_chunk = on_chunk
+        self.throttle = throttle
+        self.chunk_size = chunk_size
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        filename = os.path.basename(file_path).replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+        head = ""
+        for name, value in fields.items():
+            head += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        )
+        self._head = head.encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._length = len(self._head) + os.path.getsize(file_path) + len(self._tail)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        yield self._head
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                check_cancelled(self.cancel)
+                if self.throttle:
+                    self.throttle(len(chunk))
+                    check_cancelled(self.cancel)
+                yield chunk
+                if self.on_chunk:
+                    self.on_chunk(len(chunk))
+        yield self._tail
+
+
+def create_session(pool_size=10):
+    """requests.Session with a connection pool large enough for every upload worker"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def http_request(method, url, endpoint, session=None, **kwargs):
+    """requests call timed and counted per endpoint; endpoint is the route with ids left out"""
+    status = "error"
+    try:
+        with metrics.timer("http_request_seconds", method=method, endpoint=endpoint):
+            response = (session or requests).request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.inc("http_requests_total", method=method, endpoint=endpoint, status=status)
+
+
+def upload_file_to_immich(file_path, immich_url, api_key, logger=print, cancel=None, on_chunk=None, session=None,
+                          throttle=None):
     from datetime import datetime
 
+    check_cancelled(cancel)
     stats = os.stat(file_path)
-    headers = {
-        'Accept': 'application/json',
-        'x-api-key': api_key
-    }
 
     data = {
         'deviceAssetId': f'{file_path}-{stats.st_mtime}',
@@ -19,11 +89,15 @@ def upload_file_to_immich(file_path, immich_url, api_key, logger=print):
         'isFavorite': 'false',
     }
 
-    files = {
-        'assetData': open(file_path, 'rb')
+    body = MultipartFileStream(data, 'assetData', file_path, cancel=cancel, on_chunk=on_chunk, throttle=throttle)
+    headers = {
+        'Accept': 'application/json',
+        'Content-Type': body.content_type,
+        'x-api-key': api_key
     }
 
-    response = requests.post(f'{immich_url}/api/assets', headers=headers, data=data, files=files)
+    response = http_request("POST", f'{immich_url}/api/assets', "/api/assets", session=session,
+                            headers=headers, data=body)
 
     if response.status_code == 201:
         return response.json()["id"], "created"
@@ -38,27 +112,271 @@ def upload_file_to_immich(file_path, immich_url, api_key, logger=print):
 
 
 
-def get_or_create_album(album_name, immich_url, api_key):
+def get_or_create_album(album_name, immich_url, api_key, session=None):
     headers = {"x-api-key": api_key}
 
-    res = requests.get(f"{immich_url}/api/albums", headers=headers)
+    res = http_request("GET", f"{immich_url}/api/albums", "/api/albums", session=session, headers=headers)
     if res.status_code == 200:
         for album in res.json():
             if album["albumName"] == album_name:
                 return album["id"]
 
-    res = requests.post(f"{immich_url}/api/albums", headers=headers, json={"albumName": album_name})
+    res = http_request("POST", f"{immich_url}/api/albums", "/api/albums", session=session, headers=headers,
+                       json={"albumName": album_name})
     if res.status_code == 201:
         return res.json()["id"]
 
     return None
 
 
-def add_asset_to_album(asset_id, album_id, immich_url, api_key):
+def add_asset_to_album(asset_id, album_id, immich_url, api_key, session=None):
     headers = {"x-api-key": api_key}
-    res = requests.put(
+    res = http_request(
+        "PUT",
         f"{immich_url}/api/albums/{album_id}/assets",
+        "/api/albums/{id}/assets",
+        session=session,
         headers=headers,
         json={"ids": [asset_id]}
     )
     return res.status_code == 200
+
+
+def server_asset_record(asset):
+    """The fields the local server index keeps for one asset from the Immich API"""
+    checksum = asset.get("checksum")
+    try:
+        # Immich reports sha1 checksums base64-encoded; the index stores them as hex like hashlib
+        checksum = base64.b64decode(checksum).hex() if checksum else None
+    except ValueError:
+        pass
+    return {
+        "id": asset.get("id"),
+        "checksum": checksum,
+        "deviceAssetId": asset.get("deviceAssetId"),
+        "originalFileName": asset.get("originalFileName"),
+        "fileSize": (asset.get("exifInfo") or {}).get("fileSizeInByte"),
+        "trashed": bool(asset.get("isTrashed")),
+    }
+
+
+def search_assets_page(immich_url, api_key, page, size=1000, updated_after=None, session=None):
+    """One page of POST /api/search/metadata; returns (assets, next_page or None)"""
+    body = {"page": page, "size": size, "withExif": True, "order": "asc"}
+    if updated_after:
+        # Refresh passes include the trash so the index can drop assets deleted since the last pass
+        body["updatedAfter"] = updated_after
+        body["withDeleted"] = True
+    res = http_request("POST", f"{immich_url}/api/search/metadata", "/api/search/metadata", session=session,
+                       headers={"x-api-key": api_key, "Accept": "application/json"}, json=body)
+    res.raise_for_status()
+    assets = res.json().get("assets", {})
+    next_page = assets.get("nextPage")
+    return assets.get("items", []), int(next_page) if next_page else None
+
+
+def bootstrap_server_index(index, immich_url, api_key, logger=print, cancel=None, progress=None, session=None,
+                           page_size=1000):
+    """Page the server's asset list into index, resuming from its cursor.
+
+    Once a full pass has completed, later calls only fetch assets updated since the previous pass started.
+    """
+    cursor = index.cursor
+    if cursor.get("complete"):
+        # Refresh: only what changed since the last pass began
+        updated_after = cursor.get("pass_started")
+        page = 1
+        pass_started = datetime.now(timezone.utc).isoformat()
+        logger(f"🔄 Refreshing server index with assets updated since {updated_after}")
+    elif cursor.get("next_page"):
+        updated_after = cursor.get("updated_after")
+        page = cursor["next_page"]
+        pass_started = cursor.get("pass_started")
+        logger(f"⏯️ Resuming server index at page {page} ({len(index)} assets so far)")
+    else:
+        updated_after = None
+        page = 1
+        pass_started = datetime.now(timezone.utc).isoformat()
+        logger("📚 Indexing the Immich library…")
+
+    tracker = ProgressTracker("index", progress)
+    fetched = 0
+    while page:
+        check_cancelled(cancel)
+        assets, next_page = search_assets_page(immich_url, api_key, page, size=page_size,
+                                               updated_after=updated_after, session=session)
+        index.add([server_asset_record(asset) for asset in assets])
+        # Saved after the page is on disk, so a crash re-fetches at most one page
+        index.save_cursor(next_page=next_page, complete=next_page is None, updated_after=updated_after,
+                          pass_started=pass_started)
+        fetched += len(assets)
+        tracker.advance(files=len(assets))
+        page = next_page
+    index.compact()
+    tracker.finish()
+
+    logger(f"✅ Server index up to date: {fetched} assets fetched, {len(index)} known")
+    return fetched
+
+
+def find_assets_by_checksum(checksums, immich_url, api_key, session=None, cancel=None, batch_size=1000):
+    """Ask the server which sha1 checksums it already holds, batch_size at a time.
+
+    Uses POST /api/assets/bulk-upload-check, where a "duplicate" rejection means the asset exists.
+    Returns {checksum: asset_id} for assets present and not in the trash.
+    """
+    checksums = list(dict.fromkeys(checksum for checksum in checksums if checksum))
+    found = {}
+    for start in range(0, len(checksums), batch_size):
+        check_cancelled(cancel)
+        batch = checksums[start:start + batch_size]
+        res = http_request(
+            "POST", f"{immich_url}/api/assets/bulk-upload-check", "/api/assets/bulk-upload-check",
+            session=session, headers={"x-api-key": api_key, "Accept": "application/json"},
+            json={"assets": [{"id": checksum, "checksum": checksum} for checksum in batch]}
+        )
+        res.raise_for_status()
+        for result in res.json().get("results", []):
+            if result.get("action") == "reject" and result.get("reason") == "duplicate" \
+                    and not result.get("isTrashed"):
+                found[result["id"]] = result.get("assetId")
+    return found
+
+
+class AlbumCache:
+    """Album name -> id lookups shared by every upload worker, so each album is resolved once per run"""
+
+    def __init__(self, immich_url, api_key, session=None):
+        self.immich_url = immich_url
+        self.api_key = api_key
+        self.session = session
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def get(self, album_name):
+        # Held across the HTTP call so two devices never create the same album twice
+        with self._lock:
+            album_id = self._ids.get(album_name)
+            if album_id is None:
+                album_id = get_or_create_album(album_name, self.immich_url, self.api_key, session=self.session)
+                if album_id:
+                    self._ids[album_name] = album_id
+            return album_id
+
+    def forget(self, album_name):
+        # The album may have been deleted on the server since it was cached
+        with self._lock:
+            self._ids.pop(album_name, None)
+
+
+def album_name_for_folder(folder):
+    parts = os.path.basename(folder).split("_")
+    return "_".join(parts[2:]) if len(parts) > 2 else parts[1] if len(parts) > 1 else parts[0]
+
+
+def upload_media_folder(backup_dir, immich_url, api_key, custom_album="", logger=print, cancel=None, progress=None,
+                        album_cache=None, executor=None, session=None, server_index=None, order="walk",
+                        file_times=None, limiter=None, outcomes=None, files=None, checksums=None):
+    """Upload the media under backup_dir, or only files when given (e.g. just this sync's pulls).
+
+    checksums (path -> sha1 hex, e.g. from the pull manifest) saves re-reading those files to check
+    them against server_index, whose hits are confirmed with the server in one bulk request before
+    they are skipped. If outcomes is a dict it is filled with path -> upload status.
+    """
+    stats = {
+        "total": 0,
+        "uploaded": 0,
+        "duplicates": 0,
+        "failed": 0
+    }
+
+    if files is None:
+        files = [os.path.join(root, file) for root, _, names in os.walk(backup_dir) for file in names]
+    to_upload = [(full_path, os.path.getsize(full_path)) for full_path in files
+                 if full_path.lower().endswith(MEDIA_EXTS) and os.path.exists(full_path)]
+    to_upload = order_uploads(to_upload, order, file_times)
+    tracker = ProgressTracker("upload", progress, total_files=len(to_upload),
+                              total_bytes=sum(size for _, size in to_upload))
+    if album_cache is None:
+        album_cache = AlbumCache(immich_url, api_key, session=session)
+
+    # The index can be stale (assets deleted on the server since), so its hits are confirmed in bulk first
+    checksums = dict(checksums or {})
+    confirmed = {}
+    if server_index is not None:
+        for full_path, _ in to_upload:
+            if not checksums.get(full_path):
+                checksums[full_path] = compute_file_hash(full_path, algorithm="sha1")
+        hits = [checksums[full_path] for full_path, _ in to_upload if server_index.has_checksum(checksums[full_path])]
+        if hits:
+            try:
+                confirmed = find_assets_by_checksum(hits, immich_url, api_key, session=session, cancel=cancel)
+            except CancelledError:
+                raise
+            except Exception as e:
+                logger(f"⚠️ Could not confirm indexed assets on the server, uploading them anyway: {e}")
+            else:
+                server_index.remove([checksum for checksum in hits if checksum not in confirmed])
+
+    def upload_one(full_path, size):
+        check_cancelled(cancel)
+        logger(f"📤 Uploading: {full_path}")
+        sent = []
+        with metrics.span("upload_file", path=full_path, bytes=size) as span:
+            checksum = checksums.get(full_path) if server_index is not None else None
+            if checksum in confirmed:
+                # Immich already has these exact bytes; skip the upload but still file it into its album
+                logger(f"♻️ Already on the server, not uploading: {full_path}")
+                asset_id, upload_status = confirmed[checksum], "duplicate"
+            else:
+                asset_id, upload_status = upload_file_to_immich(
+                    full_path, immich_url, api_key, logger=logger, cancel=cancel,
+                    on_chunk=lambda n: (sent.append(n), tracker.advance(nbytes=n)), session=session,
+                    throttle=(lambda n: limiter.consume(n, cancel)) if limiter else None
+                )
+                if checksum and asset_id:
+                    server_index.add([{"id": asset_id, "checksum": checksum, "deviceAssetId": None,
+                                       "originalFileName": os.path.basename(full_path), "fileSize": size}])
+            span["result"] = upload_status
+            metrics.inc("uploaded_files_total", result=upload_status)
+            metrics.inc("uploaded_bytes_total", sum(sent))
+            # Settle up against the real size in case the upload was rejected before the body was sent
+            tracker.advance(files=1, nbytes=size - sum(sent))
+
+            if asset_id:
+                album_name = custom_album or album_name_for_folder(os.path.dirname(full_path))
+                album_id = album_cache.get(album_name)
+                if album_id:
+                    added = add_asset_to_album(asset_id, album_id, immich_url, api_key, session=session)
+                    if not added:
+                        album_cache.forget(album_name)
+                    logger(f"📁 Added to album '{album_name}': {added}")
+        if outcomes is not None:
+            outcomes[full_path] = upload_status
+        return asset_id, upload_status
+
+    # With a shared executor, uploads from several devices interleave on one worker pool
+    futures = []
+    if executor is None:
+        results = (upload_one(full_path, size) for full_path, size in to_upload)
+    else:
+        futures = [executor.submit(upload_one, full_path, size) for full_path, size in to_upload]
+        results = (future.result() for future in futures)
+
+    try:
+        for asset_id, upload_status in results:
+            stats["total"] += 1
+            if not asset_id:
+                stats["failed"] += 1
+                logger("❌ Upload failed.")
+            elif upload_status == "duplicate":
+                stats["duplicates"] += 1
+                logger("♻️ File already exists in Immich (duplicate).")
+            else:
+                stats["uploaded"] += 1
+    finally:
+        for future in futures:
+            future.cancel()
+
+    tracker.finish()
+    return stats
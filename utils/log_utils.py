@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+LOG_FILE = "immich_sync.log"
+
+
+class ConsoleLogger:
+    """print() for the CLI that worker threads can share: each message is one locked write, so lines never run together.
+
+    It also owns the console progress line (see ConsoleProgress): every message clears that line first
+    and redraws it underneath, so log output never lands on the end of the progress text.
+    """
+
+    def __init__(self, stream=None, status_stream=None):
+        self.stream = stream
+        self.status_stream = status_stream
+        self._lock = threading.Lock()
+        self._status = ""
+
+    def __call__(self, msg=""):
+        stream = self.stream or sys.stdout
+        with self._lock:
+            self._clear_status()
+            stream.write(f"{msg}\n")
+            stream.flush()
+            self._draw_status()
+
+    def set_status(self, line, final=False):
+        """Show line as the progress line; final leaves it in the log as a normal line"""
+        with self._lock:
+            self._clear_status()
+            self._status = line
+            self._draw_status()
+            if final:
+                (self.status_stream or sys.stderr).write("\n")
+                self._status = ""
+
+    def _clear_status(self):
+        if self._status:
+            stream = self.status_stream or sys.stderr
+            stream.write("\r" + " " * len(self._status) + "\r")
+            stream.flush()
+
+    def _draw_status(self):
+        if self._status:
+            stream = self.status_stream or sys.stderr
+            stream.write("\r" + self._status)
+            stream.flush()
+
+
+class BufferedLogSink:
+    """Thread-safe log buffer drained in batches by the UI thread, mirrored to a rotating file"""
+
+    def __init__(self, log_file=LOG_FILE, max_bytes=5 * 1024 * 1024, backup_count=3):
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._file_logger = None
+
+        if log_file:
+            log_dir = os.path.dirname(log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._file_logger = logging.getLogger(f"immich_sync.{id(self)}")
+            self._file_logger.setLevel(logging.INFO)
+            self._file_logger.propagate = False
+            self._file_logger.addHandler(handler)
+
+    def write(self, msg):
+        with self._lock:
+            self._pending.append(msg)
+        if self._file_logger:
+            self._file_logger.info(msg)
+
+    __call__ = write
+
+    def drain(self):
+        with self._lock:
+            if not self._pending:
+                return []
+            lines = list(self._pending)
+            self._pending.clear()
+        return lines
+
+    def close(self):
+        if self._file_logger:
+            for handler in list(self._file_logger.handlers):
+                handler.close()
+                self._file_logger.removeHandler(handler)
+
+
+# Shared so the CLI and the per-file detail messages that bypass the GUI log take the same lock
+console = ConsoleLogger()
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from utils.cancel_utils import CancelledError
+
+METRICS_FILE = "immich_sync.prom"
+SUMMARY_FILE = "immich_sync_run.json"
+METRIC_PREFIX = "immich_sync_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+MAX_SPANS = 50000
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bucket bound holding the q-th observation (what Prometheus' histogram_quantile approximates)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+class MetricsRegistry:
+    """Thread-safe counters, latency histograms and per-file trace spans for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.spans = deque(maxlen=MAX_SPANS)
+            self.spans_dropped = 0
+            self.started = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+        # Charge the time to the file being processed on this thread, if any
+        span = getattr(self._local, "span", None)
+        if span is not None:
+            phase = " ".join(str(value) for value in labels.values()) or name.replace("_seconds", "")
+            span["phases"][phase] = round(span["phases"].get(phase, 0.0) + seconds, 6)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Trace one unit of work (usually a file); yields a dict the caller can add attributes to"""
+        parent = getattr(self._local, "span", None)
+        record = {
+            "name": name,
+            "start": round(time.time() - self.started, 6),
+            "thread": threading.current_thread().name,
+            "parent": parent["name"] if parent else None,
+            "attributes": attributes,
+            "phases": {},
+            "status": "ok",
+        }
+        self._local.span = record
+        started = time.perf_counter()
+        try:
+            yield record["attributes"]
+        except CancelledError:
+            record["status"] = "cancelled"
+            raise
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+            raise
+        finally:
+            record["duration"] = round(time.perf_counter() - started, 6)
+            self._local.span = parent
+            self.observe(f"{name}_seconds", record["duration"])
+            with self._lock:
+                if len(self.spans) == self.spans.maxlen:
+                    self.spans_dropped += 1
+                self.spans.append(record)
+
+    def counter_total(self, name):
+        """A counter summed over all of its label sets"""
+        with self._lock:
+            return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def histogram_total(self, name):
+        """(observations, total seconds) of a histogram summed over all of its label sets"""
+        with self._lock:
+            histograms = [h for (key, _), h in self.histograms.items() if key == name]
+            return sum(h.count for h in histograms), sum(h.sum for h in histograms)
+
+    def spans_since(self, name, since=0.0):
+        """Finished spans called name that started at least since seconds after the registry was reset"""
+        with self._lock:
+            return [span for span in self.spans if span["name"] == name and span["start"] >= since]
+
+    def to_prometheus(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            lines = []
+            declared = set()
+            for (name, labels), value in counters:
+                metric = METRIC_PREFIX + name
+                if metric not in declared:
+                    declared.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                metric = METRIC_PREFIX + name
+                if metric not in declared:
+                    declared.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "elapsed": round(time.time() - self.started, 3),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "latencies": [
+                    {
+                        "name": name, "labels": dict(labels), "count": h.count, "total": round(h.sum, 6),
+                        "mean": round(h.sum / h.count, 6) if h.count else None, "p50": h.quantile(0.5),
+                        "p95": h.quantile(0.95), "max": round(h.max, 6),
+                    }
+                    for (name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0])
+                ],
+                "spans": list(self.spans),
+                "spans_dropped": self.spans_dropped,
+            }
+
+    def write(self, directory):
+        """Write the Prometheus textfile and the JSON run summary into directory"""
+        os.makedirs(directory, exist_ok=True)
+        prom_path = os.path.join(directory, METRICS_FILE)
+        summary_path = os.path.join(directory, SUMMARY_FILE)
+        # The textfile collector may read at any moment, so never let it see a half-written file
+        write_atomic(prom_path, self.to_prometheus())
+        write_atomic(summary_path, json.dumps(self.summary(), indent=2, ensure_ascii=False))
+        return prom_path, summary_path
+
+
+def fit_file_costs(spans):
+    """Least-squares fit of duration = per_file + per_byte * bytes over finished per-file spans.
+
+    Also reports how many of them ran at once (total span time over wall time), so an estimate
+    for N files can be divided by it. Returns None without enough samples.
+    """
+    samples = [(span["attributes"]["bytes"], span["duration"], span["start"]) for span in spans
+               if span["status"] == "ok" and span["attributes"].get("bytes")]
+    if len(samples) < 2:
+        return None
+
+    count = len(samples)
+    mean_bytes = sum(nbytes for nbytes, _, _ in samples) / count
+    mean_seconds = sum(seconds for _, seconds, _ in samples) / count
+    variance = sum((nbytes - mean_bytes) ** 2 for nbytes, _, _ in samples)
+    covariance = sum((nbytes - mean_bytes) * (seconds - mean_seconds) for nbytes, seconds, _ in samples)
+    per_byte = max(covariance / variance, 0.0) if variance else 0.0
+    per_file = max(mean_seconds - per_byte * mean_bytes, 0.0)
+
+    wall = max(start + seconds for _, seconds, start in samples) - min(start for _, _, start in samples)
+    busy = sum(seconds for _, seconds, _ in samples)
+    parallelism = max(busy / wall, 1.0) if wall > 0 else 1.0
+    return {"per_file": per_file, "per_byte": per_byte, "parallelism": parallelism, "files": count}
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def write_atomic(path, text):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+METRICS = MetricsRegistry()
+inc = METRICS.inc
+observe = METRICS.observe
+timer = METRICS.timer
+span = METRICS.span
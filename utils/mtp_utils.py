@@ -5,37 +5,104 @@ import json
 import sys
 from datetime import datetime
 import piexif
-from utils.file_utils import compute_file_hash
-
-HASH_FILE = "seen_hashes.json"
+from utils.file_utils import MEDIA_EXTS, compute_file_hashes
+from utils import metrics
+from utils.cancel_utils import CancelledError, check_cancelled
+from utils.log_utils import console
+from utils.progress_utils import ProgressTracker
+from utils.state_utils import HASH_FILE, HashIndex
+
+FOLDER_CACHE_FILE = "phone_folders_cache.json"
 NO_WINDOW = subprocess.CREATE_NO_WINDOW if sys.platform.startswith("win") else 0
-
-def run_quiet(cmd, **kwargs):
-    return subprocess.run(cmd, creationflags=NO_WINDOW, **kwargs)
-
-def get_android_file_datetime(filepath, logger=print):
+ADB = os.environ.get("IMMICH_SYNC_ADB", "adb")
+EXIFTOOL = os.environ.get("IMMICH_SYNC_EXIFTOOL", "exiftool")
+
+
+def adb_command(serial, *args):
+    """Build an adb command line, pinned to one device when a serial is given"""
+    return [ADB] + (["-s", serial] if serial else []) + list(args)
+
+def command_labels(cmd):
+    """Metric labels for a command line: the tool plus the adb subcommand (and shell program)"""
+    tool = os.path.splitext(os.path.basename(cmd[0]))[0].lower()
+    args = list(cmd[1:])
+    if tool != "adb":
+        return {"tool": tool, "command": ""}
+    if args[:1] == ["-s"]:
+        args = args[2:]
+    command = args[0] if args else ""
+    if command == "shell" and len(args) > 1:
+        command += " " + args[1].split(" ", 1)[0]
+    return {"tool": tool, "command": command}
+
+def run_quiet(cmd, cancel=None, labels=None, **kwargs):
+    """subprocess.run with metrics; labels overrides the command_labels(cmd) guess, e.g. for shell scripts"""
+    labels = labels or command_labels(cmd)
+    status = "error"
+    try:
+        with metrics.timer("subprocess_seconds", **labels):
+            result = _run_quiet(cmd, cancel=cancel, **kwargs)
+        status = "ok" if result.returncode == 0 else "failed"
+        return result
+    except CancelledError:
+        status = "cancelled"
+        raise
+    except subprocess.TimeoutExpired:
+        status = "timeout"
+        raise
+    finally:
+        metrics.inc("subprocess_total", status=status, **labels)
+
+def _run_quiet(cmd, cancel=None, **kwargs):
+    if cancel is None:
+        return subprocess.run(cmd, creationflags=NO_WINDOW, **kwargs)
+
+    # Cancellable variant: the token kills the child so communicate() returns promptly
+    check_cancelled(cancel)
+    timeout = kwargs.pop("timeout", None)
+    if kwargs.pop("capture_output", False):
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+
+    with subprocess.Popen(cmd, creationflags=NO_WINDOW, **kwargs) as proc:
+        cancel.track_process(proc)
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise
+        finally:
+            cancel.untrack_process(proc)
+
+    check_cancelled(cancel)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def get_android_file_datetime(filepath, logger=print, cancel=None, serial=None):
     import shlex
 
     result = run_quiet(
-        ["adb", "shell", f"stat -c %y '{filepath}'"],
-        capture_output=True, text=True, encoding="utf-8"
+        adb_command(serial, "shell", f"stat -c %y '{filepath}'"),
+        capture_output=True, text=True, encoding="utf-8", cancel=cancel
     )
 
     if result.returncode != 0:
         logger("⚠️ Fallback 1: Using shlex.quote()")
         escaped_path = shlex.quote(filepath)
         result = run_quiet(
-            ["adb", "shell", f"stat -c %y {escaped_path}"],
+            adb_command(serial, "shell", f"stat -c %y {escaped_path}"),
             capture_output=True,
-            text=True
+            text=True,
+            cancel=cancel
         )
 
     if result.returncode != 0:
         logger("⚠️ Fallback 2: Using ls -l as alternative")
         result = run_quiet(
-            ["adb", "shell", "ls", "-l", filepath],
+            adb_command(serial, "shell", "ls", "-l", filepath),
             capture_output=True,
-            text=True
+            text=True,
+            cancel=cancel
         )
 
         if result.returncode == 0:
@@ -69,9 +136,10 @@ def get_android_file_datetime(filepath, logger=print):
 
         escaped_path = octal_escape(filepath)
         result = run_quiet(
-            ["adb", "shell", f"stat -c %y '{escaped_path}'"],
+            adb_command(serial, "shell", f"stat -c %y '{escaped_path}'"),
             capture_output=True,
-            text=True
+            text=True,
+            cancel=cancel
         )
 
     if result.returncode != 0:
@@ -80,9 +148,10 @@ def get_android_file_datetime(filepath, logger=print):
         filename = os.path.basename(filepath)
 
         result = run_quiet(
-            ["adb", "shell", "find", dir_path, "-name", filename, "-exec", "stat", "-c", "%y", "{}", ";"],
+            adb_command(serial, "shell", "find", dir_path, "-name", filename, "-exec", "stat", "-c", "%y", "{}", ";"),
             capture_output=True,
-            text=True
+            text=True,
+            cancel=cancel
         )
 
     if result.returncode == 0:
@@ -124,28 +193,28 @@ def ensure_exif_date(image_path, fallback_datetime=None, logger=print):
         logger(f"⚠️ Failed to add EXIF date to {image_path}: {e}")
 
 
-def embed_png_gif_metadata(path, dt, logger=print):
+def embed_png_gif_metadata(path, dt, logger=print, cancel=None):
     if dt is None:
         logger(f"⚠️ No datetime available to embed for {os.path.basename(path)}")
         return
 
     ds = dt.strftime("%Y:%m:%d %H:%M:%S")
     run_quiet([
-        "exiftool", "-overwrite_original",
+        EXIFTOOL, "-overwrite_original",
         f"-CreationDate={ds}",
         f"-XMP:CreateDate={ds}",
         path
-    ])
+    ], cancel=cancel)
     logger(f"🧩 Embedded CreationDate/XMP:CreateDate in {os.path.basename(path)}")
 
-def embed_video_metadata(path, dt, logger=print):
+def embed_video_metadata(path, dt, logger=print, cancel=None):
     if dt is None:
         logger(f"⚠️ No datetime available to embed for {os.path.basename(path)}")
         return
 
     try:
         ds = dt.strftime("%Y:%m:%d %H:%M:%S")
-        args = ["exiftool", "-overwrite_original"]
+        args = [EXIFTOOL, "-overwrite_original"]
 
         if path.lower().endswith(".mov"):
             args += [
@@ -165,68 +234,124 @@ def embed_video_metadata(path, dt, logger=print):
             ]
 
         args.append(path)
-        run_quiet(args)
+        run_quiet(args, cancel=cancel)
         logger(f"🎬 Embedded metadata in {os.path.basename(path)}")
+    except CancelledError:
+        raise
     except Exception as e:
         logger(f"⚠️ Failed to embed metadata in {path}: {e}")
 
 
-def delete_files_from_phone(paths, logger=print):
-    total = len(paths)
-    success = 0
-    failed = 0
+DELETE_BATCH_CHARS = 4000
 
-    for path in paths:
-        logger(f"🗑️ Deleting: {path}")
 
-        result = run_quiet(["adb", "shell", "rm", path], capture_output=True, text=True)
+def delete_file_from_phone(path, logger=print, cancel=None, serial=None):
+    """Delete one file, trying progressively more defensive quoting; returns the last adb result"""
+    result = run_quiet(adb_command(serial, "shell", "rm", path), capture_output=True, text=True, cancel=cancel)
 
-        if result.returncode != 0:
-            logger("⚠️ Fallback 1: Using shlex.quote()")
-            escaped_path = shlex.quote(path)
-            result = run_quiet(["adb", "shell", f"rm {escaped_path}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        logger("⚠️ Fallback 1: Using shlex.quote()")
+        escaped_path = shlex.quote(path)
+        result = run_quiet(adb_command(serial, "shell", f"rm {escaped_path}"), capture_output=True, text=True, cancel=cancel)
 
-        if result.returncode != 0:
-            logger("⚠️ Fallback 2: Using double quotes")
-            escaped = path.replace('\\', '\\\\').replace('"', '\\"')
-            result = run_quiet(["adb", "shell", f'rm "{escaped}"'], capture_output=True, text=True)
+    if result.returncode != 0:
+        logger("⚠️ Fallback 2: Using double quotes")
+        escaped = path.replace('\\', '\\\\').replace('"', '\\"')
+        result = run_quiet(adb_command(serial, "shell", f'rm "{escaped}"'), capture_output=True, text=True, cancel=cancel)
 
-        if result.returncode != 0:
-            logger("⚠️ Fallback 3: Using octal escaping")
+    if result.returncode != 0:
+        logger("⚠️ Fallback 3: Using octal escaping")
 
-            def octal_escape(s):
-                result = ""
-                for char in s:
-                    if char.isalnum() or char in "/-_.":
-                        result += char
-                    else:
-                        result += f"\\{ord(char):03o}"
-                return result
+        def octal_escape(s):
+            result = ""
+            for char in s:
+                if char.isalnum() or char in "/-_.":
+                    result += char
+                else:
+                    result += f"\\{ord(char):03o}"
+            return result
 
-            escaped_path = octal_escape(path)
-            result = run_quiet(["adb", "shell", f"rm '{escaped_path}'"], capture_output=True, text=True)
+        escaped_path = octal_escape(path)
+        result = run_quiet(adb_command(serial, "shell", f"rm '{escaped_path}'"), capture_output=True, text=True, cancel=cancel)
 
-        if result.returncode != 0:
-            logger("⚠️ Fallback 4: Using find and delete")
-            dir_path = os.path.dirname(path)
-            filename = os.path.basename(path)
+    if result.returncode != 0:
+        logger("⚠️ Fallback 4: Using find and delete")
+        dir_path = os.path.dirname(path)
+        filename = os.path.basename(path)
+
+        result = run_quiet(
+            adb_command(serial, "shell", "find", dir_path, "-name", filename, "-delete"),
+            capture_output=True, text=True, cancel=cancel
+        )
 
-            result = run_quiet([
-                "adb", "shell", "find", dir_path, "-name", filename, "-delete"
-            ], capture_output=True, text=True)
+    return result
 
-        if result.returncode == 0:
-            logger(f"✅ Successfully deleted: {path}")
-            success += 1
-        else:
-            logger(f"❌ Failed to delete {path}: {result.stderr.strip()}")
-            failed += 1
+
+def delete_batch_from_phone(paths, cancel=None, serial=None):
+    """Delete several files with a single adb call; returns the paths that are still on the phone"""
+    # Echo the position of each deleted file rather than its name, so odd names can't be misread as done
+    script = (
+        "i=0; for f in " + " ".join(shlex.quote(path) for path in paths) +
+        '; do i=$((i+1)); rm -- "$f" 2>/dev/null && echo "$i"; done'
+    )
+    result = run_quiet(adb_command(serial, "shell", script), capture_output=True, text=True, cancel=cancel,
+                       labels={"tool": "adb", "command": "shell rm"})
+    deleted = {int(line) for line in result.stdout.split() if line.isdigit()}
+    return [path for i, path in enumerate(paths, 1) if i not in deleted]
+
+
+def delete_batches(paths, max_chars=DELETE_BATCH_CHARS):
+    batch = []
+    length = 0
+    for path in paths:
+        quoted = len(shlex.quote(path)) + 1
+        if batch and length + quoted > max_chars:
+            yield batch
+            batch = []
+            length = 0
+        batch.append(path)
+        length += quoted
+    if batch:
+        yield batch
+
+
+def delete_files_from_phone(paths, logger=print, cancel=None, progress=None, serial=None):
+    total = len(paths)
+    success = 0
+    failed = 0
+    tracker = ProgressTracker("delete", progress, total_files=total)
+
+    for batch in delete_batches(paths):
+        if cancel is not None and cancel.cancelled:
+            logger(f"🛑 Deletion cancelled, {total - success - failed} files left on phone")
+            break
+
+        logger(f"🗑️ Deleting {len(batch)} files…")
+        leftover = delete_batch_from_phone(batch, cancel=cancel, serial=serial)
+        success += len(batch) - len(leftover)
+        metrics.inc("deleted_files_total", len(batch) - len(leftover), result="ok")
+        tracker.advance(files=len(batch) - len(leftover))
+
+        # Anything the batch could not remove gets the one-at-a-time treatment with all its fallbacks
+        for path in leftover:
+            logger(f"🗑️ Deleting: {path}")
+            result = delete_file_from_phone(path, logger=logger, cancel=cancel, serial=serial)
+            if result.returncode == 0:
+                logger(f"✅ Successfully deleted: {path}")
+                success += 1
+            else:
+                logger(f"❌ Failed to delete {path}: {result.stderr.strip()}")
+                failed += 1
+            metrics.inc("deleted_files_total", result="ok" if result.returncode == 0 else "failed")
+            tracker.advance(files=1)
+    tracker.finish()
 
     # Sync Summary
     logger("\n📊 Deletion Summary:")
     logger(f"🔹 Total files attempted: {total}")
     logger(f"✅ Successfully deleted: {success}")
     logger(f"❌ Failed to delete: {failed}")
+    return success, failed
 
 
 
@@ -254,121 +379,215 @@ def rename_with_date_if_needed(file_path, fallback_datetime, logger=print):
         return file_path
 
 
-def pull_media_from_phone(destination, logger=print):
-    with open("config.json") as f:
-        config = json.load(f)
+def is_hidden_path(path):
+    return any(part.startswith('.') for part in path.split('/'))
 
-    paths = config.get("phone_media_paths", [])
-    os.makedirs(destination, exist_ok=True)
 
-    if os.path.exists(HASH_FILE):
-        with open(HASH_FILE, "r") as f:
-            seen_hashes = set(json.load(f))
-    else:
-        seen_hashes = set()
+def scan_phone_media(base_path, logger=print, cancel=None, serial=None):
+    """List media under base_path as (path, size, mtime) tuples; size/mtime are None on fallbacks"""
+    result = run_quiet(
+        adb_command(serial, "shell", f"find {shlex.quote(base_path)} -type f -exec stat -c '%s %Y %n' {{}} +"),
+        capture_output=True, text=True, encoding="utf-8", errors="replace", cancel=cancel
+    )
 
-    stats = {
-        "pulled": 0,
-        "duplicates_skipped": 0,
-        "total_files_seen": 0
-    }
+    if result.returncode == 0:
+        entries, unparsed = [], []
+        for line in result.stdout.split("\n"):
+            line = line.rstrip("\r")
+            if not line.strip():
+                continue
+            size, mtime, path = (line.split(" ", 2) + ["", ""])[:3]
+            if size.isdigit() and mtime.isdigit():
+                entries.append((path, int(size), int(mtime)))
+            else:
+                unparsed.append(line)
+        # An empty folder prints nothing; a stray odd line only loses size/mtime for that one file
+        if entries or not unparsed:
+            entries += [(line, None, None) for line in unparsed if line.startswith("/")]
+            return [entry for entry in entries
+                    if not is_hidden_path(entry[0]) and entry[0].lower().endswith(MEDIA_EXTS)]
+        logger("⚠️ Unexpected stat output, falling back to plain find")
 
-    pulled_paths = []
-    media_exts = (".jpg", ".jpeg", ".png", ".webp", ".mp4", ".mov", ".heic", ".gif")
+    result = run_quiet(
+        adb_command(serial, "shell", "find", base_path, "-type", "f"),
+        capture_output=True, text=True, encoding="utf-8", errors="replace", cancel=cancel
+    )
 
-    for base_path in paths:
-        logger(f"📥 Recursively scanning: {base_path}")
+    if result.returncode != 0:
+        logger(f"❌ Failed to scan {base_path} with find, trying ls -R fallback")
+        logger(f"Error: {result.stderr}")
 
         result = run_quiet(
-            ["adb", "shell", "find", base_path, "-type", "f"],
-            capture_output=True, text=True, encoding="utf-8", errors="replace"
+            adb_command(serial, "shell", "ls", "-R", base_path),
+            capture_output=True, text=True, encoding="utf-8", errors="replace", cancel=cancel
         )
 
         if result.returncode != 0:
-            logger(f"❌ Failed to scan {base_path} with find, trying ls -R fallback")
+            logger(f"❌ All scanning methods failed for {base_path}")
             logger(f"Error: {result.stderr}")
+            return []
 
-            result = run_quiet(
-                ["adb", "shell", "ls", "-R", base_path],
-                capture_output=True, text=True, encoding="utf-8", errors="replace"
-            )
-
-            if result.returncode != 0:
-                logger(f"❌ All scanning methods failed for {base_path}")
-                logger(f"Error: {result.stderr}")
-                continue
-
-            all_files = parse_ls_r_output(result.stdout, base_path)
-        else:
-            all_files = []
-            for line in result.stdout.strip().split("\n"):
-                if line and not any(part.startswith('.') for part in line.split('/')):
-                    all_files.append(line)
-
-        for phone_file in all_files:
-            if not phone_file or not phone_file.lower().endswith(media_exts):
-                continue
+        all_files = parse_ls_r_output(result.stdout, base_path)
+    else:
+        all_files = [line for line in result.stdout.strip().split("\n") if line and not is_hidden_path(line)]
 
-            stats["total_files_seen"] += 1
-            file = os.path.basename(phone_file)
-            folder_name = os.path.dirname(phone_file).strip("/").replace("/", "_")
-            local_path = os.path.join(destination, folder_name)
-            os.makedirs(local_path, exist_ok=True)
+    return [(path, None, None) for path in all_files if path and path.lower().endswith(MEDIA_EXTS)]
 
-            logger(f"⬇️ Pulling {file} from {phone_file} → {local_path}")
-            pulled_paths.append(phone_file)
 
-            pull_result = pull_file_safely(phone_file, local_path)
+def pull_media_from_phone(destination, logger=print, cancel=None, progress=None, serial=None, paths=None,
+                          hash_index=None, file_index=None, server_index=None, manifest=None):
+    """Pull new media into destination and return the phone paths that were pulled.
 
-            if not pull_result:
-                logger(f"❌ Failed to pull {file}")
-                continue
+    If manifest is a dict, it is filled with phone path -> {"local_path", "sha1", "sha256", "result", "size",
+    "mtime"} so the files can later be verified on the server before deleting them from the phone; unchanged
+    files get an entry too, with the sha1 stored in file_index. Pulled files are recorded in file_index only
+    once they have been uploaded and archived (see settle_pulled_files); files skipped because their name and
+    size are already on the server are recorded here, without a checksum.
+    """
+    if paths is None:
+        with open("config.json") as f:
+            config = json.load(f)
+        paths = config.get("phone_media_paths", [])
 
-            downloaded_files = [os.path.join(local_path, f) for f in os.listdir(local_path)]
-            newest_file = max(downloaded_files, key=os.path.getmtime)
+    os.makedirs(destination, exist_ok=True)
+    seen_hashes = hash_index if hash_index is not None else HashIndex(HASH_FILE)
 
-            safe_name = file.replace("?", "_").replace("&", "_").replace("=", "_")
-            safe_path = os.path.join(local_path, safe_name)
-            os.rename(newest_file, safe_path)
+    stats = {
+        "pulled": 0,
+        "duplicates_skipped": 0,
+        "unchanged_skipped": 0,
+        "on_server_skipped": 0,
+        "total_files_seen": 0
+    }
 
-            capture_date = get_android_file_datetime(phone_file, logger=print)
+    pulled_paths = []
+    tracker = ProgressTracker("scan", progress)
 
-            if safe_path.lower().endswith((".jpg", ".jpeg")):
-                ensure_exif_date(safe_path, fallback_datetime=capture_date, logger=print)
-            else:
-                safe_path = rename_with_date_if_needed(safe_path, fallback_datetime=capture_date)
-                if safe_path.lower().endswith((".png", ".gif", ".webp")):
-                    embed_png_gif_metadata(safe_path, capture_date)
-                elif safe_path.lower().endswith((".mov", ".heic", ".mp4")):
-                    embed_video_metadata(safe_path, capture_date)
-
-            file_hash = compute_file_hash(safe_path)
-            if file_hash in seen_hashes:
-                logger(f"🗑️ Duplicate detected. Removing {os.path.basename(safe_path)}")
-                os.remove(safe_path)
-                stats["duplicates_skipped"] += 1
-            else:
-                seen_hashes.add(file_hash)
-                stats["pulled"] += 1
-                logger(f"✅ Kept: {os.path.basename(safe_path)}")
+    try:
+        media_files = []
+        for base_path in paths:
+            check_cancelled(cancel)
+            logger(f"📥 Recursively scanning: {base_path}")
+            found = scan_phone_media(base_path, logger=logger, cancel=cancel, serial=serial)
+            media_files.extend(found)
+            tracker.advance(files=len(found))
+        tracker.finish()
+
+        sizes = [size for _, size, _ in media_files]
+        total_bytes = sum(sizes) if media_files and None not in sizes else None
+        tracker = ProgressTracker("pull", progress, total_files=len(media_files), total_bytes=total_bytes)
+
+        for phone_file, phone_size, phone_mtime in media_files:
+            check_cancelled(cancel)
+            stats["total_files_seen"] += 1
+            if file_index is not None and file_index.is_current(phone_file, phone_size, phone_mtime):
+                stats["unchanged_skipped"] += 1
+                metrics.inc("pulled_files_total", result="unchanged")
+                if manifest is not None:
+                    # Not pulled again, but still offered for deletion from the phone once verified
+                    manifest[phone_file] = {"local_path": None, "sha1": file_index.checksum(phone_file),
+                                            "sha256": None, "result": "unchanged", "size": phone_size,
+                                            "mtime": phone_mtime}
+                tracker.advance(files=1, nbytes=phone_size)
+                continue
+            if server_index is not None and server_index.has_file(os.path.basename(phone_file), phone_size):
+                # Same original name and size already in Immich: not worth a pull just to get "duplicate" back
+                stats["on_server_skipped"] += 1
+                metrics.inc("pulled_files_total", result="on_server")
+                if file_index is not None:
+                    file_index.record(phone_file, phone_size, phone_mtime)
+                tracker.advance(files=1, nbytes=phone_size)
+                continue
 
-    with open(HASH_FILE, "w") as f:
-        json.dump(list(seen_hashes), f)
+            with metrics.span("pull_file", device=serial, path=phone_file) as span:
+                file = os.path.basename(phone_file)
+                folder_name = os.path.dirname(phone_file).strip("/").replace("/", "_")
+                local_path = os.path.join(destination, folder_name)
+                os.makedirs(local_path, exist_ok=True)
+
+                logger(f"⬇️ Pulling {file} from {phone_file} → {local_path}")
+                pulled_paths.append(phone_file)
+                safe_path = os.path.join(local_path, file)
+
+                try:
+                    pull_result = pull_file_safely(phone_file, local_path, cancel=cancel, serial=serial)
+
+                    if not pull_result:
+                        logger(f"❌ Failed to pull {file}")
+                        span["result"] = "failed"
+                        metrics.inc("pulled_files_total", result="failed")
+                        if manifest is not None:
+                            manifest[phone_file] = {"local_path": None, "sha1": None, "sha256": None,
+                                                    "result": "failed", "size": phone_size, "mtime": phone_mtime}
+                        tracker.advance(files=1, nbytes=phone_size or 0)
+                        continue
+
+                    downloaded_files = [os.path.join(local_path, f) for f in os.listdir(local_path)]
+                    newest_file = max(downloaded_files, key=os.path.getmtime)
+
+                    safe_name = file.replace("?", "_").replace("&", "_").replace("=", "_")
+                    safe_path = os.path.join(local_path, safe_name)
+                    os.rename(newest_file, safe_path)
+                    pulled_bytes = os.path.getsize(safe_path)
+                    span["bytes"] = pulled_bytes
+                    metrics.inc("pulled_bytes_total", pulled_bytes)
+
+                    # Metadata details go to the console only, as before, but through its lock
+                    capture_date = get_android_file_datetime(phone_file, logger=console, cancel=cancel, serial=serial)
+
+                    if safe_path.lower().endswith((".jpg", ".jpeg")):
+                        ensure_exif_date(safe_path, fallback_datetime=capture_date, logger=console)
+                    else:
+                        safe_path = rename_with_date_if_needed(safe_path, fallback_datetime=capture_date, logger=console)
+                        if safe_path.lower().endswith((".png", ".gif", ".webp")):
+                            embed_png_gif_metadata(safe_path, capture_date, logger=console, cancel=cancel)
+                        elif safe_path.lower().endswith((".mov", ".heic", ".mp4")):
+                            embed_video_metadata(safe_path, capture_date, logger=console, cancel=cancel)
+                except CancelledError:
+                    # Drop the half-processed file so the next run pulls it again from scratch
+                    pulled_paths.pop()
+                    if os.path.exists(safe_path):
+                        os.remove(safe_path)
+                    raise
+
+                hashes = compute_file_hashes(safe_path)
+                if not seen_hashes.add(hashes["sha256"]):
+                    logger(f"🗑️ Duplicate detected. Removing {os.path.basename(safe_path)}")
+                    os.remove(safe_path)
+                    stats["duplicates_skipped"] += 1
+                    span["result"] = "duplicate"
+                else:
+                    stats["pulled"] += 1
+                    span["result"] = "kept"
+                    logger(f"✅ Kept: {os.path.basename(safe_path)}")
+                metrics.inc("pulled_files_total", result=span["result"])
+                if manifest is not None:
+                    manifest[phone_file] = {"local_path": safe_path, "sha1": hashes["sha1"],
+                                            "sha256": hashes["sha256"], "result": span["result"],
+                                            "size": phone_size, "mtime": phone_mtime}
+                tracker.advance(files=1, nbytes=pulled_bytes)
+        tracker.finish()
+    finally:
+        seen_hashes.save()
+        if file_index is not None:
+            file_index.save()
 
     logger("\n📊 Sync Summary:")
     logger(f"🔹 Total files found: {stats['total_files_seen']}")
     logger(f"🔹 New files pulled: {stats['pulled']}")
-    logger(f"🔹 Duplicates skipped: {stats['duplicates_skipped']}\n")
+    logger(f"🔹 Duplicates skipped: {stats['duplicates_skipped']}")
+    logger(f"🔹 Unchanged since last sync: {stats['unchanged_skipped']}")
+    logger(f"🔹 Already on the server: {stats['on_server_skipped']}\n")
 
     return pulled_paths
 
 
-def pull_file_safely(phone_file, local_path, logger=print):
+def pull_file_safely(phone_file, local_path, logger=print, cancel=None, serial=None):
     """Safely pull a file that might have special characters in its name"""
 
     result = run_quiet(
-        ["adb", "pull", phone_file, local_path],
-        capture_output=True, text=True
+        adb_command(serial, "pull", phone_file, local_path),
+        capture_output=True, text=True, cancel=cancel
     )
 
     if result.returncode == 0:
@@ -378,17 +597,17 @@ def pull_file_safely(phone_file, local_path, logger=print):
 
     escaped_path = shlex.quote(phone_file)
     result = run_quiet(
-        ["adb", "shell", f"cp {escaped_path} /sdcard/temp_file && exit"],
-        capture_output=True, text=True
+        adb_command(serial, "shell", f"cp {escaped_path} /sdcard/temp_file && exit"),
+        capture_output=True, text=True, cancel=cancel
     )
 
     if result.returncode == 0:
         result = run_quiet(
-            ["adb", "pull", "/sdcard/temp_file", local_path],
-            capture_output=True, text=True
+            adb_command(serial, "pull", "/sdcard/temp_file", local_path),
+            capture_output=True, text=True, cancel=cancel
         )
 
-        run_quiet(["adb", "shell", "rm", "/sdcard/temp_file"], capture_output=True)
+        run_quiet(adb_command(serial, "shell", "rm", "/sdcard/temp_file"), capture_output=True)
 
         if result.returncode == 0:
             return True
@@ -414,4 +633,103 @@ def parse_ls_r_output(output, base_path):
                 full_path = os.path.join(current_dir, line).replace('\\', '/')
                 files.append(full_path)
 
-    return files
\ No newline at end of file
+    return files
+
+
+def list_connected_devices():
+    result = run_quiet([ADB, "devices"], capture_output=True, text=True)
+    serials = []
+    for line in result.stdout.strip().split("\n")[1:]:
+        parts = line.split()
+        if len(parts) >= 2 and parts[1] == "device":
+            serials.append(parts[0])
+    return serials
+
+
+def list_phone_folder(path, cancel=None, serial=None):
+    """List the subfolders of path with their recursive media count and size in a single adb call.
+
+    Returns (name, media_count, media_bytes, has_subfolders) tuples, or None if the listing failed.
+    """
+    name_filter = " -o ".join(f"-iname '*{ext}'" for ext in MEDIA_EXTS)
+    script = (
+        f"cd {shlex.quote(path)} || exit 1; "
+        "for d in */; do "
+        "[ -d \"$d\" ] || continue; d=\"${d%/}\"; n=0; t=0; "
+        f"for s in $(find \"$d\" -type f \\( {name_filter} \\) ! -path '*/.*' -exec stat -c %s {{}} + 2>/dev/null); do "
+        "n=$((n+1)); t=$((t+s)); done; "
+        "k=0; for c in \"$d\"/*/; do [ -d \"$c\" ] && k=1 && break; done; "
+        "echo \"$n|$t|$k|$d\"; "
+        "done"
+    )
+    result = run_quiet(
+        adb_command(serial, "shell", script),
+        capture_output=True, text=True, encoding="utf-8", errors="replace", cancel=cancel
+    )
+    if result.returncode != 0:
+        return None
+
+    entries = []
+    for line in result.stdout.strip().split("\n"):
+        parts = line.split("|", 3)
+        if len(parts) != 4 or not parts[0].isdigit() or not parts[1].isdigit():
+            continue
+        count, size, has_children, name = parts
+        if name.startswith("."):
+            continue
+        entries.append((name, int(count), int(size), has_children == "1"))
+    return sorted(entries, key=lambda entry: entry[0].lower())
+
+
+def load_folder_cache(serial=None):
+    """Return (serial, listings) from the on-disk cache; defaults to the last device seen"""
+    try:
+        with open(FOLDER_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return serial, {}
+
+    serial = serial or cache.get("last_serial")
+    listings = cache.get("devices", {}).get(serial, {})
+    return serial, {path: [tuple(entry) for entry in entries] for path, entries in listings.items()}
+
+
+def save_folder_cache(serial, listings):
+    try:
+        with open(FOLDER_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+
+    cache["last_serial"] = serial
+    cache.setdefault("devices", {})[serial] = listings
+    tmp_path = FOLDER_CACHE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, FOLDER_CACHE_FILE)
+
+
+def track_devices(cancel=None):
+    """Yield {serial: state} snapshots from `adb track-devices` until adb exits or cancel is set"""
+    proc = subprocess.Popen([ADB, "track-devices"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            creationflags=NO_WINDOW)
+    if cancel is not None:
+        cancel.track_process(proc)
+    try:
+        while True:
+            # Each message is a 4-digit hex length followed by "serial\tstate" lines
+            header = proc.stdout.read(4)
+            if len(header) < 4:
+                return
+            payload = proc.stdout.read(int(header, 16)).decode("utf-8", errors="replace")
+            states = {}
+            for line in payload.splitlines():
+                parts = line.split("\t")
+                if len(parts) == 2:
+                    states[parts[0]] = parts[1]
+            yield states
+    finally:
+        if cancel is not None:
+            cancel.untrack_process(proc)
+        proc.kill()
+        proc.wait()
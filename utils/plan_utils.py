@@ -0,0 +1,133 @@
+import os
+from utils.cancel_utils import check_cancelled
+from utils.mtp_utils import scan_phone_media
+from utils.progress_utils import format_bytes, format_duration
+from utils.schedule_utils import BandwidthLimiter
+from utils.state_utils import FileIndex, ServerIndex, ThroughputHistory
+from utils.sync_utils import device_media_paths
+
+PLAN_COUNTS = ("files", "bytes", "unchanged", "on_server", "to_pull", "pull_bytes", "unknown_size")
+
+
+def empty_counts():
+    return dict.fromkeys(PLAN_COUNTS, 0)
+
+
+def add_counts(counts_list):
+    totals = empty_counts()
+    for counts in counts_list:
+        for key in PLAN_COUNTS:
+            totals[key] += counts[key]
+    return totals
+
+
+def plan_device(serial, config, file_index=None, server_index=None, logger=print, cancel=None):
+    """What syncing one device would do, from one stat listing per folder and the local indexes alone.
+
+    Per phone folder: files and bytes on the phone, unchanged (pulled before and untouched), on_server
+    (same name and size already in Immich), to_pull and pull_bytes, and unknown_size for files the
+    fallback listing gave no size for. Nothing is pulled, hashed or sent to the server.
+    """
+    file_index = file_index if file_index is not None else FileIndex.for_device(serial)
+    folders = {}
+
+    for base_path in device_media_paths(config, serial):
+        check_cancelled(cancel)
+        for phone_file, size, mtime in scan_phone_media(base_path, logger=logger, cancel=cancel, serial=serial):
+            counts = folders.setdefault(os.path.dirname(phone_file), empty_counts())
+            counts["files"] += 1
+            counts["bytes"] += size or 0
+            if file_index.is_current(phone_file, size, mtime):
+                counts["unchanged"] += 1
+            elif server_index is not None and server_index.has_file(os.path.basename(phone_file), size):
+                counts["on_server"] += 1
+            else:
+                counts["to_pull"] += 1
+                counts["pull_bytes"] += size or 0
+                counts["unknown_size"] += size is None
+
+    return {"serial": serial, "folders": folders, "totals": add_counts(folders.values())}
+
+
+def estimate_durations(devices, config, history=None):
+    """Seconds per stage from the cost models of recent runs; a stage is None until it has history"""
+    history = history or ThroughputHistory.default()
+    totals = add_counts(device["totals"] for device in devices.values())
+
+    def slowest(stage):
+        # Devices pull and archive side by side, so the slowest one sets the pace
+        estimates = [history.estimate(stage, device["totals"]["to_pull"], device["totals"]["pull_bytes"])
+                     for device in devices.values()]
+        return None if None in estimates else max(estimates, default=0.0)
+
+    # ...but they share one upload pool and one bandwidth cap
+    upload = history.estimate("upload", totals["to_pull"], totals["pull_bytes"])
+    limiter = BandwidthLimiter.from_config(config)
+    rate = limiter.current_rate() if limiter else None
+    if upload is not None and rate:
+        upload = max(upload, totals["pull_bytes"] / rate)
+
+    estimates = {"pull": slowest("pull"), "upload": upload, "compress": slowest("compress")}
+    stages = list(estimates.values())
+    estimates["total"] = None if None in stages else sum(stages)
+    return estimates
+
+
+def plan_sync(serials, config, logger=print, cancel=None, context=None):
+    """Dry run of sync_devices: per-device plans, their totals and estimated durations"""
+    if context is not None:
+        server_index, file_index = context.server_index, context.file_index
+    else:
+        server_index, file_index = ServerIndex.for_server(config["immich_url"]), FileIndex.for_device
+
+    devices = {}
+    for serial in serials:
+        logger(f"🔎 Planning {serial}…")
+        devices[serial] = plan_device(serial, config, file_index=file_index(serial), server_index=server_index,
+                                      logger=logger, cancel=cancel)
+
+    return {
+        "devices": devices,
+        "totals": add_counts(device["totals"] for device in devices.values()),
+        "estimates": estimate_durations(devices, config, history=context.throughput if context else None),
+        "server_index_size": len(server_index),
+    }
+
+
+def format_size(counts, key="pull_bytes"):
+    size = format_bytes(counts[key])
+    return f"≥{size}" if counts["unknown_size"] else size
+
+
+def format_plan(plan):
+    """The plan as log lines: one table per device, then totals and the time estimate"""
+    lines = []
+    for serial, device in plan["devices"].items():
+        lines.append(f"📋 Plan for {serial}:")
+        if not device["folders"]:
+            lines.append("   No media found in the configured folders")
+            continue
+        width = max(len("Folder"), *(len(folder) for folder in device["folders"]))
+        lines.append(f"   {'Folder':<{width}}  {'Files':>7}  {'Unchanged':>9}  {'On server':>9}  {'To pull':>7}  {'Size':>10}")
+        for folder, counts in sorted(device["folders"].items()):
+            lines.append(f"   {folder:<{width}}  {counts['files']:>7}  {counts['unchanged']:>9}  "
+                         f"{counts['on_server']:>9}  {counts['to_pull']:>7}  {format_size(counts):>10}")
+
+    totals = plan["totals"]
+    lines.append(f"🔹 Media on the phone: {totals['files']} files ({format_size(totals, 'bytes')})")
+    lines.append(f"🔹 Unchanged since the last sync: {totals['unchanged']}")
+    lines.append(f"🔹 Expected duplicates (already in Immich, skipped): {totals['on_server']}")
+    lines.append(f"🔹 To pull and upload: {totals['to_pull']} files ({format_size(totals)})")
+    if totals["unknown_size"]:
+        lines.append(f"⚠️ {totals['unknown_size']} files have no known size, so sizes and times are lower bounds")
+    if not plan["server_index_size"]:
+        lines.append("💡 The server index is empty; run `python main.py --bootstrap` to spot files already in Immich")
+
+    estimates = plan["estimates"]
+    if estimates["total"] is None:
+        lines.append("⏱️ No time estimate yet: it is learned from the next completed sync")
+    else:
+        lines.append(f"⏱️ Estimated time: ~{format_duration(estimates['total'])} (pull {format_duration(estimates['pull'])}, "
+                     f"upload {format_duration(estimates['upload'])}, archive {format_duration(estimates['compress'])})")
+    lines.append("ℹ️ Files with the same content as something already uploaded are only found once pulled and hashed")
+    return lines
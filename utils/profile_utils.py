@@ -0,0 +1,141 @@
+import io
+import os
+import sys
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from utils import metrics
+from utils.progress_utils import format_bytes
+
+
+class RunProfiler:
+    """cProfile + tracemalloc around a whole sync run, reported next to the backup directory.
+
+    Threads started while profiling (device pipelines, upload workers) get their own profiler,
+    and all of them are merged into one report.
+    """
+
+    def __init__(self, output_dir, label="sync", top=40, logger=print):
+        self.output_dir = output_dir
+        self.label = label
+        self.top = top
+        self.logger = logger
+        self._profilers = []
+        self._lock = threading.Lock()
+        self._subprocesses_before = {}
+        self._metrics_started = None
+        self._started_tracemalloc = False
+        self._stopped = False
+
+    def _profile_new_thread(self, frame, event, arg):
+        # Runs once as the first profile event of each new thread, then hands over to cProfile
+        sys.setprofile(None)
+        if self._stopped:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: cProfile already sees every thread through sys.monitoring
+            return
+        with self._lock:
+            self._profilers.append(profiler)
+
+    def start(self):
+        self._metrics_started = metrics.METRICS.started
+        self._subprocesses_before = subprocess_launches()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        self._profilers.append(profiler)
+        threading.setprofile(self._profile_new_thread)
+        return self
+
+    def stop(self):
+        """Stop profiling and write <label>_<time>.pstats, a text report and return the report path"""
+        threading.setprofile(None)
+        self._stopped = True
+        for profiler in self._profilers:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        launches = subprocess_launches()
+        if metrics.METRICS.started == self._metrics_started:
+            launches = {key: count - self._subprocesses_before.get(key, 0) for key, count in launches.items()}
+        launches = {key: count for key, count in launches.items() if count}
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile_{self.label}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}")
+        stats = pstats.Stats(self._profilers[0])
+        for profiler in self._profilers[1:]:
+            try:
+                stats.add(profiler)
+            except TypeError:
+                # A thread that never ran any Python code has nothing to merge
+                pass
+        stats.dump_stats(base + ".pstats")
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"Profile of {self.label} run, {datetime.now().isoformat(timespec='seconds')}\n")
+            f.write(f"Threads profiled: {len(self._profilers)}\n\n")
+
+            f.write("== Subprocess launches by command ==\n")
+            for (tool, command), count in sorted(launches.items(), key=lambda item: -item[1]):
+                f.write(f"{count:>8}  {tool} {command}".rstrip() + "\n")
+            f.write(f"{sum(launches.values()):>8}  total\n\n")
+
+            for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "own time")):
+                f.write(f"== Top {self.top} functions by {title} ==\n")
+                f.write(format_stats(stats, sort_key, self.top))
+                f.write("\n")
+
+            f.write(f"== Memory: peak {format_bytes(peak)}, still allocated {format_bytes(current)} ==\n")
+            f.write(f"== Top {self.top} allocation sites ==\n")
+            for stat in snapshot.filter_traces(ignored_traces()).statistics("lineno")[:self.top]:
+                frame = stat.traceback[0]
+                f.write(f"{format_bytes(stat.size):>10}  {stat.count:>8} blocks  {frame.filename}:{frame.lineno}\n")
+
+        self.logger(f"🔬 Profile written to {base}.txt and {base}.pstats")
+        return base + ".txt"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        try:
+            self.stop()
+        except Exception as e:
+            self.logger(f"⚠️ Failed to write profile: {e}")
+
+
+def subprocess_launches():
+    """{(tool, command): launches} from the subprocess counters run_quiet keeps"""
+    launches = {}
+    for item in metrics.METRICS.summary()["counters"]:
+        if item["name"] == "subprocess_total":
+            key = (item["labels"].get("tool", ""), item["labels"].get("command", ""))
+            launches[key] = launches.get(key, 0) + item["value"]
+    return launches
+
+
+def format_stats(stats, sort_key, top):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort_key).print_stats(top)
+    return stream.getvalue()
+
+
+def ignored_traces():
+    return [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
@@ -0,0 +1,132 @@
+import sys
+import time
+import threading
+
+
+def format_bytes(num):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num) < 1024:
+            return f"{num:.1f} {unit}" if unit != "B" else f"{int(num)} B"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+class ProgressTracker:
+    """Counts files/bytes for one stage and emits throttled progress events to a callback"""
+
+    def __init__(self, stage, callback=None, total_files=None, total_bytes=None, min_interval=0.25):
+        self.stage = stage
+        self.callback = callback
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.min_interval = min_interval
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def advance(self, files=0, nbytes=0):
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+        self._emit()
+
+    def finish(self):
+        self._emit(force=True, finished=True)
+
+    def snapshot(self, finished=False):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            files_per_sec = self.files_done / elapsed
+            bytes_per_sec = self.bytes_done / elapsed
+
+            eta = None
+            if not finished:
+                if self.total_bytes and bytes_per_sec > 0:
+                    eta = max(self.total_bytes - self.bytes_done, 0) / bytes_per_sec
+                elif self.total_files and files_per_sec > 0:
+                    eta = max(self.total_files - self.files_done, 0) / files_per_sec
+
+            return {
+                "stage": self.stage,
+                "files_done": self.files_done,
+                "files_total": self.total_files,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.total_bytes,
+                "elapsed": elapsed,
+                "files_per_sec": files_per_sec,
+                "bytes_per_sec": bytes_per_sec,
+                "eta": 0 if finished else eta,
+                "finished": finished,
+            }
+
+    def _emit(self, force=False, finished=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+        self.callback(self.snapshot(finished=finished))
+
+
+def progress_fraction(event):
+    if event["bytes_total"]:
+        return min(event["bytes_done"] / event["bytes_total"], 1.0)
+    if event["files_total"]:
+        return min(event["files_done"] / event["files_total"], 1.0)
+    return None
+
+
+def format_progress(event):
+    files = f"{event['files_done']}/{event['files_total']}" if event["files_total"] is not None else str(event["files_done"])
+    device = f"[{event['device']}] " if event.get("device") else ""
+    parts = [f"{device}{event['stage'].capitalize()}: {files} files"]
+    if event["bytes_total"]:
+        parts.append(f"{format_bytes(event['bytes_done'])}/{format_bytes(event['bytes_total'])}")
+    elif event["bytes_done"]:
+        parts.append(format_bytes(event["bytes_done"]))
+    parts.append(f"{format_bytes(event['bytes_per_sec'])}/s")
+    parts.append(f"{event['files_per_sec']:.1f} files/s")
+    if event["finished"]:
+        parts.append(f"done in {format_duration(event['elapsed'])}")
+    else:
+        parts.append(f"ETA {format_duration(event['eta'])}")
+    return " · ".join(parts)
+
+
+class ConsoleProgress:
+    """Renders progress events as a single, continuously rewritten console line.
+
+    Given the console logger, the line is drawn through it, so log messages from worker threads
+    clear and redraw it instead of being appended to it.
+    """
+
+    def __init__(self, stream=sys.stderr, console=None):
+        self.stream = stream
+        self.console = console
+        self._width = 0
+
+    def __call__(self, event):
+        fraction = progress_fraction(event)
+        prefix = f"[{fraction * 100:5.1f}%] " if fraction is not None else ""
+        line = prefix + format_progress(event)
+        if self.console is not None:
+            self.console.set_status(line, final=event["finished"])
+            return
+        self.stream.write("\r" + line.ljust(self._width))
+        self._width = len(line)
+        if event["finished"]:
+            self.stream.write("\n")
+            self._width = 0
+        self.stream.flush()
@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import threading
+from datetime import datetime
+import piexif
+from utils import metrics
+
+VIDEO_EXTS = (".mp4", ".mov")
+UPLOAD_ORDERS = ("walk", "smallest_first", "newest_first", "photos_first")
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# 2MB, 500 KB/s, 1.5mB, 300000: only an upper-case B (bytes), since 2Mb / 2Mbps conventionally mean bits
+RATE = re.compile(r"(\d+(?:\.\d*)?|\.\d+)([kKmMgG]?)B?(?:/[sS])?")
+# IMG_20240131_235959.jpg, 20240131-235959.mp4, ... (the pull also names undated files this way)
+DATE_IN_NAME = re.compile(r"((?:19|20)\d{2})(\d{2})(\d{2})[_-]?(\d{2})(\d{2})(\d{2})")
+
+
+def order_uploads(files, order="walk", file_times=None):
+    """Sort (path, size) pairs for upload.
+
+    walk keeps os.walk order; smallest_first gets many photos done before one huge video;
+    newest_first uses file_times (path -> phone mtime) when known, else capture_time(), never the pull time;
+    photos_first sends everything that isn't a video before the videos, otherwise in walk order.
+    """
+    if order == "smallest_first":
+        return sorted(files, key=lambda item: item[1])
+    if order == "newest_first":
+        file_times = file_times or {}
+        return sorted(files, key=lambda item: file_times.get(item[0]) or capture_time(item[0]), reverse=True)
+    if order == "photos_first":
+        return sorted(files, key=lambda item: item[0].lower().endswith(VIDEO_EXTS))
+    if order != "walk":
+        raise ValueError(f"Unknown upload order {order!r}; expected one of {', '.join(UPLOAD_ORDERS)}")
+    return list(files)
+
+
+def capture_time(path):
+    """When a staged file was taken, as a timestamp.
+
+    EXIF DateTimeOriginal for JPEGs (the pull fills it in), then a date in the file name, and only
+    then the local mtime, which for a pulled file is when it was pulled.
+    """
+    if path.lower().endswith((".jpg", ".jpeg")):
+        try:
+            taken = piexif.load(path).get("Exif", {}).get(piexif.ExifIFD.DateTimeOriginal)
+            if taken:
+                return datetime.strptime(taken.decode(), "%Y:%m:%d %H:%M:%S").timestamp()
+        except Exception:
+            pass
+    match = DATE_IN_NAME.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*map(int, match.groups())).timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(path)
+
+
+def parse_rate(value):
+    """Bytes per second from a number or a string like "2MB" / "500 KB/s"; None means unlimited"""
+    if value in (None, "", 0) or str(value).strip().lower() == "unlimited":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = RATE.fullmatch(str(value).replace(" ", ""))
+    if not match:
+        hint = " (bits are not supported, give bytes)" if "b" in str(value) else ""
+        raise ValueError(f"Unrecognised bandwidth {value!r}{hint}; use bytes/sec or e.g. \"2MB\", \"500KB\"")
+    return float(match.group(1)) * RATE_UNITS[match.group(2).upper()] or None
+
+
+def parse_clock(value):
+    hours, minutes = str(value).split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class BandwidthLimiter:
+    """Token bucket shared by every upload worker; the rate can follow a time-of-day schedule.
+
+    schedule is a list of (start_minute, end_minute, bytes_per_sec) windows in local time; a window
+    whose end is before its start runs past midnight. Outside every window, default_rate applies.
+    """
+
+    def __init__(self, default_rate=None, schedule=None, burst_seconds=1.0, clock=time.monotonic, now=datetime.now):
+        self.default_rate = default_rate
+        self.schedule = schedule or []
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.now = now
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = clock()
+
+    @classmethod
+    def from_config(cls, config):
+        """From config.json's "upload_bandwidth"; returns None when uploads are never capped.
+
+        "upload_bandwidth": {"default": "unlimited",
+                             "schedule": [{"from": "08:00", "to": "18:00", "limit": "1MB"}]}
+        A plain number or string instead of the object caps uploads at all times.
+        """
+        setting = config.get("upload_bandwidth")
+        if not isinstance(setting, dict):
+            setting = {"default": setting}
+        default_rate = parse_rate(setting.get("default"))
+        schedule = [
+            (parse_clock(window["from"]), parse_clock(window["to"]), parse_rate(window.get("limit")))
+            for window in setting.get("schedule", [])
+        ]
+        if default_rate is None and not any(rate for _, _, rate in schedule):
+            return None
+        return cls(default_rate, schedule)
+
+    def current_rate(self):
+        now = self.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            inside = start <= minute < end if start <= end else minute >= start or minute < end
+            if inside:
+                return rate
+        return self.default_rate
+
+    def consume(self, nbytes, cancel=None):
+        """Block until nbytes may be sent at the current rate"""
+        with self._lock:
+            rate = self.current_rate()
+            now = self.clock()
+            if not rate:
+                self._tokens = 0.0
+                self._last = now
+                return
+            # Tokens may go negative; that debt is what this caller (and the ones queued behind it) wait off
+            self._tokens = min(self._tokens + (now - self._last) * rate, rate * self.burst_seconds)
+            self._last = now
+            self._tokens -= nbytes
+            delay = -self._tokens / rate if self._tokens < 0 else 0.0
+
+        if delay:
+            metrics.observe("upload_throttle_seconds", delay)
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
@@ -0,0 +1,301 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+STATE_DIR = "state"
+HASH_FILE = "seen_hashes.json"
+
+
+def device_state_dir(serial):
+    path = os.path.join(STATE_DIR, serial)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomic(path, data):
+    # Per-thread temp name: two devices saving the same file at once must not share it
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class HashIndex:
+    """Set of content hashes already pulled, persisted as a JSON list"""
+
+    def __init__(self, path, seed_path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hashes = set()
+
+        source = path if os.path.exists(path) else seed_path
+        if source and os.path.exists(source):
+            with open(source, "r") as f:
+                self._hashes = set(json.load(f))
+
+    @classmethod
+    def for_device(cls, serial):
+        # Devices synced before per-device state existed start from the old shared hash file
+        return cls(os.path.join(device_state_dir(serial), "seen_hashes.json"), seed_path=HASH_FILE)
+
+    def __contains__(self, file_hash):
+        with self._lock:
+            return file_hash in self._hashes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._hashes)
+
+    def add(self, file_hash):
+        """Record file_hash; returns False if it was already known"""
+        with self._lock:
+            if file_hash in self._hashes:
+                return False
+            self._hashes.add(file_hash)
+            return True
+
+    def discard(self, file_hash):
+        with self._lock:
+            self._hashes.discard(file_hash)
+
+    def save(self):
+        with self._lock:
+            hashes = list(self._hashes)
+        write_json_atomic(self.path, hashes)
+
+
+class FileIndex:
+    """Phone path -> [size, mtime, sha1] of files already synced, so unchanged files are skipped next sync.
+
+    The sha1 (of the staged copy that was uploaded) lets a later run still verify and delete them from the phone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._files = json.load(f)
+
+    @classmethod
+    def for_device(cls, serial):
+        return cls(os.path.join(device_state_dir(serial), "pulled_files.json"))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._files)
+
+    def is_current(self, phone_path, size, mtime):
+        if size is None or mtime is None:
+            return False
+        with self._lock:
+            entry = self._files.get(phone_path)
+            return entry is not None and entry[:2] == [size, mtime]
+
+    def checksum(self, phone_path):
+        """sha1 recorded for phone_path, or None (entries from before checksums were kept have none)"""
+        with self._lock:
+            entry = self._files.get(phone_path)
+            return entry[2] if entry and len(entry) > 2 else None
+
+    def record(self, phone_path, size, mtime, sha1=None):
+        if size is None or mtime is None:
+            return
+        with self._lock:
+            self._files[phone_path] = [size, mtime, sha1] if sha1 else [size, mtime]
+
+    def save(self):
+        with self._lock:
+            files = dict(self._files)
+        write_json_atomic(self.path, files)
+
+
+class ServerIndex:
+    """Assets already on the Immich server: sha1 checksums plus (original name, size) pairs.
+
+    Stored as a JSONL of assets, appended to page by page and compacted after each completed pass,
+    plus a small cursor file, so a bootstrap over a huge library can stop at any page and resume.
+    """
+
+    def __init__(self, path, server_url=None):
+        self.path = path
+        self.cursor_path = os.path.splitext(path)[0] + ".cursor.json"
+        self._lock = threading.Lock()
+        self._checksums = {}
+        self._files = set()
+        # id -> (checksum, deviceAssetId, originalFileName, fileSize), what compact() writes back
+        self._assets = {}
+        self.cursor = {}
+
+        if os.path.exists(self.cursor_path):
+            with open(self.cursor_path, "r", encoding="utf-8") as f:
+                self.cursor = json.load(f)
+        if server_url and self.cursor.get("server") not in (None, server_url):
+            # Built from a different server; its contents say nothing about this one
+            self.cursor = {}
+            if os.path.exists(path):
+                os.remove(path)
+        if server_url:
+            self.cursor["server"] = server_url
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._remember(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a crash mid-write; the cursor makes us fetch that page again
+                        continue
+
+    @classmethod
+    def for_server(cls, server_url):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        return cls(os.path.join(STATE_DIR, "server_index.jsonl"), server_url=server_url)
+
+    def _remember(self, asset):
+        asset_id = asset.get("id")
+        previous = self._assets.pop(asset_id, None) if asset_id else None
+        if previous:
+            # Seen again in a refresh: drop what the older copy said, it may have been edited
+            self._forget(previous[0], previous[2], previous[3])
+
+        if asset.get("trashed"):
+            # Trashed on the server since it was indexed: it has to be synced again
+            self._forget(asset.get("checksum"), asset.get("originalFileName"), asset.get("fileSize"))
+            return
+        if asset_id:
+            self._assets[asset_id] = (asset.get("checksum"), asset.get("deviceAssetId"),
+                                      asset.get("originalFileName"), asset.get("fileSize"))
+        if asset.get("checksum"):
+            self._checksums[asset["checksum"]] = asset_id
+        if asset.get("originalFileName") and asset.get("fileSize") is not None:
+            self._files.add((asset["originalFileName"].lower(), asset["fileSize"]))
+
+    def _forget(self, checksum, name, size):
+        self._checksums.pop(checksum, None)
+        if name and size is not None:
+            self._files.discard((name.lower(), size))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._assets)
+
+    def has_checksum(self, sha1_hex):
+        with self._lock:
+            return sha1_hex in self._checksums
+
+    def asset_id(self, sha1_hex):
+        with self._lock:
+            return self._checksums.get(sha1_hex)
+
+    def has_file(self, name, size):
+        if size is None:
+            return False
+        with self._lock:
+            return (name.lower(), size) in self._files
+
+    def add(self, assets):
+        """Append assets ({id, checksum, deviceAssetId, originalFileName, fileSize}) and remember them"""
+        if not assets:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for asset in assets:
+                    f.write(json.dumps(asset, ensure_ascii=False) + "\n")
+                    self._remember(asset)
+
+    def remove(self, checksums):
+        """Forget assets the server no longer has (e.g. deleted and the trash emptied)"""
+        if not checksums:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for checksum in checksums:
+                    # Written as trashed, so reloading the JSONL forgets it again
+                    asset = {"id": self._checksums.get(checksum), "checksum": checksum, "trashed": True}
+                    f.write(json.dumps(asset, ensure_ascii=False) + "\n")
+                    self._remember(asset)
+
+    def compact(self):
+        """Rewrite the JSONL with one line per live asset.
+
+        Uploads and refresh passes only append, so the same asset can appear many times; compacting
+        after a completed pass keeps loading it proportional to the library, not to its history.
+        """
+        with self._lock:
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for asset_id, (checksum, device_asset_id, name, size) in self._assets.items():
+                    f.write(json.dumps({"id": asset_id, "checksum": checksum, "deviceAssetId": device_asset_id,
+                                        "originalFileName": name, "fileSize": size}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Forget everything, so the next bootstrap starts a full pass"""
+        with self._lock:
+            self._assets.clear()
+            self._checksums.clear()
+            self._files.clear()
+            self.cursor = {"server": self.cursor.get("server")}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            cursor = dict(self.cursor)
+        write_json_atomic(self.cursor_path, cursor)
+
+    def save_cursor(self, **fields):
+        with self._lock:
+            self.cursor.update(fields)
+            cursor = dict(self.cursor)
+        write_json_atomic(self.cursor_path, cursor)
+
+
+class ThroughputHistory:
+    """Per-stage cost models from recent runs (seconds per file, per byte, parallelism) for estimating durations"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stages = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._stages = json.load(f)
+
+    @classmethod
+    def default(cls):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        return cls(os.path.join(STATE_DIR, "throughput.json"))
+
+    def get(self, stage):
+        with self._lock:
+            model = self._stages.get(stage)
+            return dict(model) if model else None
+
+    def update(self, stage, model, weight=0.5):
+        """Blend a new run's model into the stored one, so one odd run doesn't swing every estimate"""
+        with self._lock:
+            previous = self._stages.get(stage)
+            if previous:
+                model = dict(model, **{
+                    key: previous[key] * (1 - weight) + model[key] * weight
+                    for key in ("per_file", "per_byte", "parallelism") if key in previous and key in model
+                })
+            self._stages[stage] = dict(model, updated=datetime.now().isoformat(timespec="seconds"))
+
+    def estimate(self, stage, files, nbytes):
+        """Seconds to process files totalling nbytes in stage, or None without history"""
+        if not files:
+            return 0.0
+        model = self.get(stage)
+        if not model:
+            return None
+        seconds = files * model.get("per_file", 0.0) + (nbytes or 0) * model.get("per_byte", 0.0)
+        return seconds / model.get("parallelism", 1.0)
+
+    def save(self):
+        # Written under the lock, so an older snapshot can never replace a newer one on disk
+        with self._lock:
+            write_json_atomic(self.path, self._stages)
@@ -0,0 +1,356 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import metrics
+from utils.cancel_utils import CancelledError
+from utils.file_utils import compress_backup
+from utils.immich_api import AlbumCache, create_session, upload_media_folder, find_assets_by_checksum
+from utils.mtp_utils import pull_media_from_phone, delete_files_from_phone, track_devices
+from utils.schedule_utils import BandwidthLimiter, UPLOAD_ORDERS
+from utils.state_utils import HashIndex, FileIndex, ServerIndex, ThroughputHistory
+
+UPLOAD_WORKERS = 4
+
+
+def device_media_paths(config, serial):
+    device_config = config.get("devices", {}).get(serial, {})
+    return device_config.get("phone_media_paths", config.get("phone_media_paths", []))
+
+
+def device_staging_dir(config, serial):
+    return os.path.join(config["temp_import_dir"], serial)
+
+
+def backup_root_dir(config):
+    # Next to the staging root, so cleaning up temp_import_dir never deletes archives or reports
+    return os.path.dirname(config["temp_import_dir"].rstrip("/\\"))
+
+
+def write_metrics(config, logger=print):
+    """Write the Prometheus textfile and JSON run summary to metrics_dir (default: the backup root)"""
+    try:
+        prom_path, summary_path = metrics.METRICS.write(config.get("metrics_dir") or backup_root_dir(config))
+        logger(f"📈 Metrics written to {prom_path} and {summary_path}")
+    except Exception as e:
+        logger(f"⚠️ Failed to write metrics: {e}")
+
+
+def record_throughput(since, archive_before=(0, 0.0, 0), logger=print, history=None):
+    """Fold this run's per-file pull/upload timings and archive speed into the planner's history.
+
+    since is the run's start in seconds after the metrics registry was reset; archive_before is
+    archive_totals() from that moment, so a long-running daemon only counts its latest sync.
+    history should be the context's, so concurrent syncs update one object instead of each
+    reloading the file and overwriting the other's result.
+    """
+    try:
+        history = history or ThroughputHistory.default()
+        pulls = metrics.METRICS.spans_since("pull_file", since)
+        # Uploads skipped through the server index never hit the network and would skew the fit
+        uploads = [span for span in metrics.METRICS.spans_since("upload_file", since)
+                   if "POST /api/assets" in span["phases"]]
+        for stage, spans in (("pull", pulls), ("upload", uploads)):
+            model = metrics.fit_file_costs(spans)
+            if model:
+                history.update(stage, model)
+
+        files, seconds, nbytes = (now - before for now, before in zip(archive_totals(), archive_before))
+        if files > 1 and nbytes:
+            history.update("compress", {"per_file": 0.0, "per_byte": seconds / nbytes, "parallelism": 1.0,
+                                        "files": files})
+        history.save()
+    except Exception as e:
+        logger(f"⚠️ Failed to record throughput: {e}")
+
+
+def archive_totals():
+    count, seconds = metrics.METRICS.histogram_total("archive_write_seconds")
+    return count, seconds, metrics.METRICS.counter_total("archive_bytes_total")
+
+
+class SyncContext:
+    """Warm state kept between runs: HTTP pool, upload workers, album cache and per-device indexes"""
+
+    def __init__(self, config, upload_workers=UPLOAD_WORKERS):
+        self.config = config
+        self.session = create_session(pool_size=upload_workers + 2)
+        self.album_cache = AlbumCache(config["immich_url"], config["api_key"], session=self.session)
+        self.upload_pool = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix="upload")
+        # Filled by `main.py --bootstrap` and by every upload; empty until then
+        self.server_index = ServerIndex.for_server(config["immich_url"])
+        # One bucket for all devices: the cap is on the shared uplink, not per phone
+        self.bandwidth = BandwidthLimiter.from_config(config)
+        # Per-stage cost models for the planner, updated by every sync this context runs
+        self.throughput = ThroughputHistory.default()
+        self.upload_order = config.get("upload_order", "walk")
+        if self.upload_order not in UPLOAD_ORDERS:
+            raise ValueError(f"upload_order must be one of {', '.join(UPLOAD_ORDERS)}, not {self.upload_order!r}")
+        self._hash_indexes = {}
+        self._file_indexes = {}
+        self._lock = threading.Lock()
+
+    def hash_index(self, serial):
+        with self._lock:
+            if serial not in self._hash_indexes:
+                self._hash_indexes[serial] = HashIndex.for_device(serial)
+            return self._hash_indexes[serial]
+
+    def file_index(self, serial):
+        with self._lock:
+            if serial not in self._file_indexes:
+                self._file_indexes[serial] = FileIndex.for_device(serial)
+            return self._file_indexes[serial]
+
+    def close(self):
+        self.upload_pool.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def new_files(manifest):
+    """Staged paths of the files this sync pulled and kept"""
+    return [entry["local_path"] for entry in manifest.values() if entry["result"] == "kept"]
+
+
+def settle_pulled_files(manifest, outcomes, file_index, hash_index, archived=False):
+    """Mark pulled files as synced only once Immich has them and they are in an archive.
+
+    outcomes maps staged path -> upload status; archived says whether this sync's archive was written.
+    Anything else is pulled again next time, so its content hash is forgotten too, or the next pull
+    would drop it as an already-seen duplicate. Otherwise a cancelled or failed compression would
+    leave files in no archive, and local cleanup would then delete the only local copy.
+    """
+    kept = [(path, entry) for path, entry in manifest.items() if entry["result"] == "kept"]
+    for phone_path, entry in kept:
+        if archived and outcomes.get(entry["local_path"], "error") != "error":
+            file_index.record(phone_path, entry["size"], entry["mtime"], entry["sha1"])
+        else:
+            hash_index.discard(entry["sha256"])
+
+    # Same content as a file already pulled: done only if that copy is done
+    for phone_path, entry in manifest.items():
+        if entry["result"] == "duplicate" and entry["sha256"] in hash_index:
+            file_index.record(phone_path, entry["size"], entry["mtime"], entry["sha1"])
+
+    file_index.save()
+    hash_index.save()
+
+
+def sync_device(serial, context, custom_album="", logger=print, cancel=None, progress=None):
+    """Pull, upload and archive one device into its own staging folder and state store"""
+    config = context.config
+    staging_dir = device_staging_dir(config, serial)
+
+    logger("📥 Pulling files from phone…")
+    manifest = {}
+    outcomes = {}
+    archived = False
+    try:
+        pulled_paths = pull_media_from_phone(
+            staging_dir, logger=logger, cancel=cancel, progress=progress, serial=serial,
+            paths=device_media_paths(config, serial), hash_index=context.hash_index(serial),
+            file_index=context.file_index(serial), server_index=context.server_index, manifest=manifest
+        )
+
+        logger("🚀 Uploading to Immich…")
+        stats = upload_media_folder(
+            staging_dir, config["immich_url"], config["api_key"], custom_album=custom_album,
+            logger=logger, cancel=cancel, progress=progress, album_cache=context.album_cache,
+            executor=context.upload_pool, session=context.session, server_index=context.server_index,
+            order=context.upload_order, limiter=context.bandwidth, outcomes=outcomes, files=new_files(manifest),
+            checksums={entry["local_path"]: entry["sha1"] for entry in manifest.values() if entry["local_path"]},
+            file_times={entry["local_path"]: entry["mtime"] for entry in manifest.values() if entry["local_path"]}
+        )
+
+        # Only this sync's pulls: anything an earlier sync staged but didn't finish was pulled again above
+        compress_backup(staging_dir, logger=logger, cancel=cancel, progress=progress,
+                        archive_dir=backup_root_dir(config), label=serial, files=new_files(manifest))
+        archived = True
+    finally:
+        # Also on cancel or error, so nothing counts as synced before it is in Immich and archived
+        settle_pulled_files(manifest, outcomes, context.file_index(serial), context.hash_index(serial), archived)
+
+    return {
+        "serial": serial,
+        "pulled_paths": pulled_paths,
+        "manifest": manifest,
+        "stats": stats,
+        "staging_dir": staging_dir
+    }
+
+
+def sync_devices(serials, config, custom_album="", logger=print, cancel=None, progress=None, context=None):
+    """Run one pipeline per device concurrently, sharing the context's upload pool and album cache.
+
+    Returns {serial: result}; a device that fails gets an "error" entry instead of stopping the others.
+    """
+    if context is None:
+        with SyncContext(config) as context:
+            return sync_devices(serials, config, custom_album, logger, cancel, progress, context=context)
+
+    tag = len(serials) > 1
+    since = time.time() - metrics.METRICS.started
+    archive_before = archive_totals()
+
+    def for_device(serial):
+        device_logger = (lambda msg: logger(f"[{serial}] {msg}")) if tag else logger
+        device_progress = (lambda event: progress(dict(event, device=serial))) if progress and tag else progress
+        return device_logger, device_progress
+
+    results = {}
+    cancelled = False
+    with ThreadPoolExecutor(max_workers=max(len(serials), 1), thread_name_prefix="device") as device_pool:
+        futures = {}
+        for serial in serials:
+            device_logger, device_progress = for_device(serial)
+            futures[serial] = device_pool.submit(
+                sync_device, serial, context, custom_album, logger=device_logger, cancel=cancel,
+                progress=device_progress
+            )
+
+        for serial, future in futures.items():
+            try:
+                results[serial] = future.result()
+            except CancelledError:
+                cancelled = True
+            except Exception as e:
+                for_device(serial)[0](f"❌ Sync failed: {e}")
+                results[serial] = {"serial": serial, "error": str(e), "pulled_paths": [], "manifest": {}}
+
+    record_throughput(since, archive_before, logger=logger, history=context.throughput)
+    if cancelled:
+        raise CancelledError("Operation cancelled by user")
+    return results
+
+
+def deletable_paths(result):
+    """Phone paths offered for deletion: this sync's pulls plus unchanged files synced by an earlier run.
+
+    Unchanged files recorded before checksums were kept have no sha1 to verify, so they are left alone.
+    """
+    manifest = result.get("manifest", {})
+    unchanged = [path for path, entry in manifest.items() if entry["result"] == "unchanged" and entry["sha1"]]
+    return result["pulled_paths"] + unchanged
+
+
+def verify_pulled_on_server(result, config, cancel=None, session=None):
+    """Split a device's deletable paths into ones whose exact content is confirmed on the server and the rest.
+
+    Returns (verified_paths, [(path, reason), ...]); everything is checked in a few bulk requests.
+    """
+    manifest = result.get("manifest", {})
+    found = find_assets_by_checksum(
+        [entry["sha1"] for entry in manifest.values() if entry.get("sha1")],
+        config["immich_url"], config["api_key"], session=session, cancel=cancel
+    )
+
+    verified = []
+    unverified = []
+    for path in deletable_paths(result):
+        entry = manifest.get(path)
+        if entry is None or not entry.get("sha1"):
+            unverified.append((path, "pull failed" if entry else "no checksum recorded"))
+        elif entry["sha1"] in found:
+            verified.append(path)
+        else:
+            unverified.append((path, "not found on the server"))
+    return verified, unverified
+
+
+def delete_verified_from_phone(results, config, logger=print, cancel=None, progress=None, session=None):
+    """Delete from each phone only the synced files the server confirms it holds; report the rest"""
+    for serial, result in results.items():
+        if "error" in result:
+            continue
+        candidates = deletable_paths(result)
+        if not candidates:
+            continue
+        logger(f"🔍 Verifying {len(candidates)} synced files from {serial} on the server…")
+        try:
+            verified, unverified = verify_pulled_on_server(result, config, cancel=cancel, session=session)
+        except CancelledError:
+            raise
+        except Exception as e:
+            logger(f"❌ Could not verify files on the server, nothing deleted from {serial}: {e}")
+            continue
+
+        logger(f"✅ {len(verified)} files confirmed on the server")
+        for path, reason in unverified:
+            logger(f"⚠️ Keeping on phone ({reason}): {path}")
+        if unverified:
+            logger(f"⚠️ {len(unverified)} files stay on {serial} because they could not be verified")
+        if verified:
+            logger(f"🔄 Deleting verified files from {serial}...")
+            delete_files_from_phone(verified, logger=logger, cancel=cancel, progress=progress, serial=serial)
+
+
+def cleanup_after_sync(results, config, delete_from_phone=False, delete_local=False, logger=print, cancel=None,
+                       progress=None):
+    if delete_from_phone:
+        delete_verified_from_phone(results, config, logger=logger, cancel=cancel, progress=progress)
+    if not delete_local:
+        return
+    for serial, result in results.items():
+        if "error" in result:
+            continue
+        try:
+            shutil.rmtree(result["staging_dir"])
+            logger(f"🗑️ Local pulled media for {serial} deleted.")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger(f"❌ Failed to delete local folder for {serial}: {e}")
+
+
+def run_daemon(context, known_serials, custom_album="", delete_from_phone=False, delete_local=False,
+               logger=print, cancel=None, retry_delay=5):
+    """Watch `adb track-devices` and start an incremental sync whenever a known device connects"""
+    known_serials = set(known_serials)
+    running = {}
+    previous = {}
+
+    def sync_once(serial):
+        device_logger = lambda msg: logger(f"[{serial}] {msg}")
+        try:
+            results = sync_devices([serial], context.config, custom_album, logger=device_logger, cancel=cancel,
+                                   context=context)
+            cleanup_after_sync(results, context.config, delete_from_phone, delete_local, logger=device_logger,
+                               cancel=cancel)
+            device_logger("✅ Sync finished")
+        except CancelledError:
+            device_logger("🛑 Sync stopped")
+        except Exception as e:
+            device_logger(f"❌ Sync failed: {e}")
+        finally:
+            write_metrics(context.config, logger=device_logger)
+
+    logger(f"👀 Watching for devices: {', '.join(sorted(known_serials))}")
+    while cancel is None or not cancel.cancelled:
+        for states in track_devices(cancel=cancel):
+            for serial, state in states.items():
+                if state != "device" or previous.get(serial) == "device" or serial not in known_serials:
+                    continue
+                thread = running.get(serial)
+                if thread is not None and thread.is_alive():
+                    continue
+                logger(f"🔌 {serial} connected, starting sync")
+                running[serial] = threading.Thread(target=sync_once, args=(serial,), daemon=True)
+                running[serial].start()
+            previous = states
+
+        if cancel is None:
+            time.sleep(retry_delay)
+        elif cancel.wait(retry_delay):
+            break
+        logger("⚠️ adb track-devices exited, restarting…")
+        previous = {}
+
+    for thread in running.values():
+        thread.join()